@@ -12,6 +12,9 @@ import okhttp3.Response
 import okhttp3.WebSocket
 import okhttp3.WebSocketListener
 import okio.ByteString
+import okio.ByteString.Companion.toByteString
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
 import java.io.StringReader
 import java.util.concurrent.Executors
 import java.util.concurrent.TimeUnit
@@ -105,10 +108,11 @@ class WebSocketManager(private val serverUrl: String) {
 ) {
         if (AppState.shouldSendData() && AppState.isAudioServiceEnabled) {
             updateMessageId()
-            val message = """{ "message_id": "$messageId", "type": "audio", "data": "${audioData.toBase64()}", "device_id": 1}"""
-            sendMessage(message)
+            // Binary frame (see realtime/protocol.py): skips base64 and JSON for the highest-volume stream
+            val frame = buildBinaryFrame(FRAME_TYPE_AUDIO, 1, audioData)
+            sendBinaryMessage(frame)
 
-            AppState.totalAudioBytesTransferred += message.toByteArray().size
+            AppState.totalAudioBytesTransferred += frame.size
         }
     }
 
@@ -291,6 +295,32 @@ class WebSocketManager(private val serverUrl: String) {
         }
     }
 
+    private fun buildBinaryFrame(frameType: Int, deviceId: Int, payload: ByteArray): ByteArray {
+        val uuid = java.util.UUID.fromString(messageId)
+        val buffer = ByteBuffer.allocate(FRAME_HEADER_SIZE + payload.size).order(ByteOrder.LITTLE_ENDIAN)
+        buffer.put(FRAME_VERSION.toByte())
+        buffer.put(frameType.toByte())
+        buffer.putInt(deviceId)
+        // UUID bytes are big-endian, matching uuid.UUID(bytes=...) on the server
+        buffer.order(ByteOrder.BIG_ENDIAN)
+        buffer.putLong(uuid.mostSignificantBits)
+        buffer.putLong(uuid.leastSignificantBits)
+        buffer.order(ByteOrder.LITTLE_ENDIAN)
+        buffer.putLong(System.currentTimeMillis())
+        buffer.put(payload)
+        return buffer.array()
+    }
+
+    private fun sendBinaryMessage(frame: ByteArray) {
+        try {
+            webSocket?.send(frame.toByteString())
+            messageSendTimes[messageId] = System.currentTimeMillis() // Store the send time
+        } catch (e: Exception) {
+            Log.e("WebSocketManager", "Error sending binary message", e)
+            e.printStackTrace()
+        }
+    }
+
     fun sendPowerConnectionStatus(isPlugged: Boolean) {
         if (AppState.shouldSendData()) {
             val message = """{"type": "power_connection", "data": {"isPlugged": $isPlugged}, "device_id": 1, "message_id": "$messageId"}"""
@@ -345,5 +375,8 @@ class WebSocketManager(private val serverUrl: String) {
 
     companion object {
         private const val NORMAL_CLOSURE_STATUS = 1000
+        private const val FRAME_VERSION = 1
+        private const val FRAME_TYPE_AUDIO = 1
+        private const val FRAME_HEADER_SIZE = 30
     }
 }
\ No newline at end of file
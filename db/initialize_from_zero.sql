@@ -544,6 +544,7 @@ CREATE TABLE public.known_class_detections (
     CONSTRAINT known_class_detections_known_class_fkey FOREIGN KEY (known_class_id) REFERENCES public.known_classes(id)
 );
 ALTER TABLE public.known_class_detections ADD ground_truth bool NULL;
+ALTER TABLE public.known_class_detections ADD source_data_ref text NULL;
 
 CREATE INDEX idx_known_class_detections_known_class_id ON public.known_class_detections (known_class_id);
 CREATE INDEX idx_known_class_detections_source_data_type ON public.known_class_detections (source_data_type);
@@ -552,6 +553,7 @@ COMMENT ON TABLE public.known_class_detections IS 'Stores detections of known cl
 COMMENT ON COLUMN public.known_class_detections.known_class_id IS 'References the id of the detected known class';
 COMMENT ON COLUMN public.known_class_detections.distance IS 'Distance measure for the detection, e.g., cosine distance for embeddings';
 COMMENT ON COLUMN public.known_class_detections.source_data IS 'Raw source data that triggered the detection, if available';
+COMMENT ON COLUMN public.known_class_detections.source_data_ref IS 'Content-addressed blob key of the compressed source clip, used instead of source_data';
 COMMENT ON COLUMN public.known_class_detections.source_data_type IS 'Type of the source data';
 COMMENT ON COLUMN public.known_class_detections.metadata IS 'Additional metadata about the detection in JSON format';
 
@@ -0,0 +1,173 @@
+import os
+import json
+import logging
+import asyncpg
+import numpy as np
+from libraries.db.pgvector import register_vector_asyncpg
+from libraries.db.vector_search import build_search_query, search_settings
+
+# Hot statements used by the realtime service. asyncpg prepares each one server-side the
+# first time a pooled connection runs it and reuses the prepared statement afterwards.
+INSERT_WEBSOCKET_METADATA = """
+INSERT INTO websocket_metadata (connected_at, disconnected_at, client_ip, client_user_agent, status)
+VALUES ($1, $2, $3, $4, $5);
+"""
+
+SELECT_APP_USAGE_TODAY = """
+SELECT id FROM app_usage_stats
+WHERE package_name = $1 AND DATE(created_at) = DATE(NOW());
+"""
+
+UPDATE_APP_USAGE = """
+UPDATE app_usage_stats
+SET total_time_in_foreground = $1, first_timestamp = $2, last_timestamp = $3, last_time_used = $4, last_time_visible = $5, last_time_foreground_service_used = $6, total_time_visible = $7, total_time_foreground_service_used = $8
+WHERE id = $9;
+"""
+
+INSERT_APP_USAGE = """
+INSERT INTO app_usage_stats (total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used, package_name)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9);
+"""
+
+SELECT_DETECTION_AUDIO = """
+SELECT source_data, source_data_ref
+FROM known_class_detections
+WHERE id = $1 AND source_data_type = 'audio'
+"""
+
+UPDATE_GROUND_TRUTH = """
+UPDATE known_class_detections
+SET ground_truth = $1
+WHERE id = $2
+RETURNING known_class_id::text, embedding
+"""
+
+SELECT_GPS_BETWEEN = """
+SELECT * FROM gps_data
+WHERE created_at >= $1 AND created_at <= $2
+ORDER BY created_at DESC
+"""
+
+INSERT_KNOWN_CLASS_DETECTION = """
+INSERT INTO known_class_detections
+(known_class_id, distance, source_data, source_data_type, metadata, embedding, source_data_ref)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+RETURNING id
+"""
+
+
+def _encode_json(value):
+    # Callers mostly pass json.dumps() output already; don't encode it twice
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class AsyncDB:
+    """
+    asyncio counterpart of DB for async handlers, backed by an asyncpg connection pool.
+
+    Queries use $1, $2 ... placeholders. connect() must be awaited (e.g. on app startup)
+    before the first query.
+    """
+
+    def __init__(self, host, port, database, user, password, min_connections=None, max_connections=None):
+        self.dsn_params = dict(
+            host=host or os.getenv("POSTGRES_HOST"),
+            port=port or os.getenv("POSTGRES_PORT"),
+            database=database or os.getenv("POSTGRES_DB"),
+            user=user or os.getenv("POSTGRES_USER"),
+            password=password or os.getenv("POSTGRES_PASSWORD")
+        )
+        # Its own pool, separate from the psycopg2 one a process may also have
+        self.min_connections = int(min_connections or os.getenv("POSTGRES_ASYNC_POOL_MIN", 1))
+        self.max_connections = int(max_connections or os.getenv("POSTGRES_ASYNC_POOL_MAX", 10))
+        self.pool = None
+
+    @staticmethod
+    async def _init_connection(connection):
+        for type_name in ("json", "jsonb"):
+            await connection.set_type_codec(type_name, encoder=_encode_json, decoder=json.loads, schema="pg_catalog")
+        try:
+            # vector values travel as binary float32 both ways
+            await register_vector_asyncpg(connection)
+        except ValueError as e:
+            logging.error(f"pgvector codec not registered: {e}")
+
+    async def connect(self):
+        if self.pool is None:
+            try:
+                self.pool = await asyncpg.create_pool(
+                    min_size=self.min_connections,
+                    max_size=self.max_connections,
+                    init=self._init_connection,
+                    **self.dsn_params
+                )
+            except Exception as e:
+                logging.error(f"Error connecting to the database: {e}")
+                raise
+        return self
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetch(self, query, *args):
+        return await self.pool.fetch(query, *args)
+
+    async def fetchrow(self, query, *args):
+        return await self.pool.fetchrow(query, *args)
+
+    async def fetchval(self, query, *args):
+        return await self.pool.fetchval(query, *args)
+
+    async def execute(self, query, *args):
+        return await self.pool.execute(query, *args)
+
+    async def query(self, query, *args):
+        """Like DB.sync_query: returns the rows, or None after logging the error."""
+        try:
+            return await self.pool.fetch(query, *args)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            logging.error(f"The error '{e}' occurred")
+            return None
+
+    async def vector_search(self, space, vector, k=10, metric="cosine", start_time=None, end_time=None, device_id=None, columns=None, ef_search=None, probes=None):
+        """Same as DB.vector_search; the query vector is sent as a binary parameter."""
+        sql, params = build_search_query(space, metric, k, columns, start_time, end_time, device_id, placeholder="$")
+        params[0] = np.asarray(vector, dtype=np.float32)
+        settings = search_settings(ef_search, probes)
+        if not settings:
+            return await self.fetch(sql, *params)
+        async with self.pool.acquire() as connection:
+            # SET LOCAL only lasts for this transaction
+            async with connection.transaction():
+                for statement in settings:
+                    await connection.execute(statement)
+                return await connection.fetch(sql, *params)
+
+    async def insert_websocket_metadata(self, connected_at, disconnected_at, client_ip, client_user_agent, status):
+        await self.execute(INSERT_WEBSOCKET_METADATA, connected_at, disconnected_at, client_ip, client_user_agent, status)
+
+    async def insert_app_usage_stats(self, package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used):
+        values = (total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used)
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                existing_id = await connection.fetchval(SELECT_APP_USAGE_TODAY, package_name)
+                if existing_id:
+                    await connection.execute(UPDATE_APP_USAGE, *values, existing_id)
+                else:
+                    await connection.execute(INSERT_APP_USAGE, *values, package_name)
+
+    async def get_detection_audio(self, known_class_detection_id):
+        """Returns (source_data, source_data_ref); new clips only have the blob reference."""
+        return await self.fetchrow(SELECT_DETECTION_AUDIO, known_class_detection_id)
+
+    async def update_ground_truth(self, known_class_detection_id, ground_truth):
+        """Returns the detection's (known_class_id, embedding) so callers can learn from it."""
+        return await self.fetchrow(UPDATE_GROUND_TRUTH, ground_truth, known_class_detection_id)
+
+    async def get_gps_data(self, start_time, end_time):
+        return await self.fetch(SELECT_GPS_BETWEEN, start_time, end_time)
+
+    async def insert_known_class_detection(self, known_class_id, distance, source_data, source_data_type, metadata, embedding, source_data_ref=None):
+        return await self.fetchval(INSERT_KNOWN_CLASS_DETECTION, known_class_id, distance, source_data, source_data_type, metadata, embedding, source_data_ref)
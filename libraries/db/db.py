@@ -1,53 +1,212 @@
 import os
 import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 import logging
 import time
 import json
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import threading
+import weakref
+import asyncio
+from libraries.db.executor import BoundedExecutor
+from libraries.db.statement_cache import StatementCache
+from libraries.db.write_buffer import WriteBuffer
+from libraries.db.pgvector import register_vector_psycopg2, copy_vectors, vector_from_text, Vector
+from libraries.db.vector_search import build_search_query, search_settings
+
+# Errors that mean the connection itself is unusable and should be replaced
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+class IdleKeepingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that opens minconn connections up front and more only on demand,
+    but keeps returned connections open (up to maxconn) instead of closing every one beyond
+    minconn, so a busy pool doesn't reconnect on nearly every checkout.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # After the initial connections, minconn is only the number of idle connections
+        # _putconn keeps instead of closing
+        self.minconn = maxconn
+
 
 class DB:
-    def __init__(self, host, port, database, user, password):
-        self.connection = self.connect(host, port, database, user, password)
-        self.cursor = self.connection.cursor()
+    def __init__(self, host, port, database, user, password, min_connections=None, max_connections=None, health_check_interval=30):
+        self.max_connections = int(max_connections or os.getenv("POSTGRES_POOL_MAX", 10))
+        # Opened up front; the rest are opened when needed and then kept open
+        self.min_connections = min(int(min_connections or os.getenv("POSTGRES_POOL_MIN", 1)), self.max_connections)
+        self.health_check_interval = health_check_interval
+        self.pool = self.connect(host, port, database, user, password, self.min_connections, self.max_connections)
+        # ThreadedConnectionPool raises instead of waiting when exhausted, so bound checkouts ourselves
+        self._pool_slots = threading.BoundedSemaphore(self.max_connections)
+        # Keyed by the connection object itself, so entries go away with connections the pool closes
+        self._last_used = weakref.WeakKeyDictionary()
+        self._connection = None
+        self.statement_cache = StatementCache(max_size=int(os.getenv("POSTGRES_STATEMENT_CACHE_SIZE", 64)))
+        self._write_buffer = None
+        self._write_buffer_lock = threading.Lock()
+        # Background statements run on as many workers as there are pooled connections
+        self.executor = BoundedExecutor(
+            max_workers=self.max_connections,
+            max_queue=int(os.getenv("POSTGRES_EXECUTOR_QUEUE", 1000))
+        )
+        # vector columns come back as float32 NumPy arrays instead of '[...]' strings
+        try:
+            self.vector_support = self.run(register_vector_psycopg2)
+        except psycopg2.Error as e:
+            logging.error(f"Error registering pgvector types: {e}")
+            self.vector_support = False
 
     @staticmethod
-    def connect(host, port, database, user, password):
+    def connect(host, port, database, user, password, min_connections=1, max_connections=10):
         try:
-            connection = psycopg2.connect(
+            pool = IdleKeepingConnectionPool(
+                min_connections,
+                max_connections,
                 host=host or os.getenv("POSTGRES_HOST"),
                 port=port or os.getenv("POSTGRES_PORT"),
                 database=database or os.getenv("POSTGRES_DB"),
                 user=user or os.getenv("POSTGRES_USER"),
                 password=password or os.getenv("POSTGRES_PASSWORD")
             )
-            return connection
+            return pool
         except Exception as e:
             logging.error(f"Error connecting to the database: {e}")
             raise
 
-    def query(self, query, params=None):
-        with self.connection.cursor() as cursor:
-            cursor.execute(query, params)
+    @property
+    def connection(self):
+        # Dedicated connection for callers that manage their own cursors and transactions
+        # (scheduled ingesters, gotify logging). It is held until close_connection().
+        if self._connection is None or self._connection.closed:
+            if self._connection is not None:
+                self._release(self._connection, discard=True)
+            self._connection = self._acquire()
+        return self._connection
+
+    @property
+    def write_buffer(self):
+        # Created on first use so processes that never buffer writes don't start a flush thread
+        with self._write_buffer_lock:
+            if self._write_buffer is None:
+                self._write_buffer = WriteBuffer(
+                    self,
+                    max_rows=int(os.getenv("POSTGRES_BUFFER_MAX_ROWS", 500)),
+                    flush_interval=float(os.getenv("POSTGRES_BUFFER_FLUSH_SECONDS", 0.25))
+                )
+            return self._write_buffer
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        # Only ping connections that have been idle for a while
+        if time.monotonic() - self._last_used.get(connection, 0) < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _acquire(self):
+        self._pool_slots.acquire()
+        try:
+            connection = self.pool.getconn()
+            if not self._is_healthy(connection):
+                logging.warning("Discarding broken database connection and reconnecting")
+                self.statement_cache.forget(connection)
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            return connection
+        except Exception:
+            self._pool_slots.release()
+            raise
+
+    def _release(self, connection, discard=False):
+        try:
+            if not discard and not connection.closed:
+                if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                self._last_used[connection] = time.monotonic()
+            else:
+                self._last_used.pop(connection, None)
+                self.statement_cache.forget(connection)
+            self.pool.putconn(connection, close=discard or bool(connection.closed))
+        except Exception as e:
+            logging.error(f"Error returning connection to the pool: {e}")
+        finally:
+            self._pool_slots.release()
+
+    @contextmanager
+    def get_connection(self):
+        connection = self._acquire()
+        discard = False
+        try:
+            yield connection
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self._release(connection, discard=discard or bool(connection.closed))
+
+    def run(self, work, retries=1):
+        """
+        Check out a pooled connection, call work(cursor), commit and return its result.
+
+        Broken connections are dropped from the pool and the work is retried on a fresh one.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.get_connection() as connection:
+                    try:
+                        with connection.cursor() as cursor:
+                            result = work(cursor)
+                        connection.commit()
+                        return result
+                    except psycopg2.Error:
+                        if not connection.closed:
+                            connection.rollback()
+                        raise
+            except CONNECTION_ERRORS as e:
+                attempt += 1
+                if attempt > retries:
+                    raise
+                logging.warning(f"Database connection lost, reconnecting (attempt {attempt}/{retries}): {e}")
+
+    def _statement(self, query, params=None, prepare=False):
+        def work(cursor):
+            if prepare:
+                self.statement_cache.execute(cursor, query, params)
+            else:
+                cursor.execute(query, params)
+            # Statements without a result set (INSERT/UPDATE without RETURNING) have no description
+            if cursor.description is None:
+                return None
             return cursor.fetchall()
+        return work
+
+    def query(self, query, params=None, prepare=False):
+        return self.run(self._statement(query, params, prepare))
 
 
     def execute(self, query, params=None):
+        """Run a statement on the worker pool. Returns a Future with the fetched rows (None on error)."""
         def run_query():
-            cursor = self.connection.cursor()
             try:
-                cursor.execute(query, params)
-                self.connection.commit()
-                return cursor.fetchall()
+                return self.run(self._statement(query, params))
             except psycopg2.Error as e:
                 print(f"The error '{e}' occurred")
-                self.connection.rollback()
                 return None
-            finally:
-                cursor.close()
 
-        thread = threading.Thread(target=run_query)
-        thread.start()
+        return self.executor.submit(run_query)
 
 
     def poll_query(self, query, interval, callback, trigger_on_all_queries=False):
@@ -61,9 +220,7 @@ class DB:
         
         while not self._cancel_polling:
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(query)
-                result = cursor.fetchall()
+                result = self.query(query, prepare=True)
                 
                 if first_fetch:
                     first_fetch = False
@@ -82,8 +239,6 @@ class DB:
             except Exception as e:
                 logging.error(f"Error executing query: {query} {e}")
                 break
-            finally:
-                cursor.close()
 
     def cancel_polling(self):
         self._cancel_polling = True
@@ -91,57 +246,41 @@ class DB:
             self._polling_thread.join()
 
 
-    def pgvector_similarity_search(self, table_name, vector_column, query_vector, columns='*', top_k=10, max_retries=3):
+    def vector_search(self, space, vector, k=10, metric="cosine", start_time=None, end_time=None, device_id=None, columns=None, ef_search=None, probes=None):
         """
-        Perform a similarity search using pgvector with retry logic.
-
-        :param table_name: Name of the table to search.
-        :param vector_column: Name of the column containing the vectors.
-        :param query_vector: The query vector to compare against.
-        :param columns: Columns to select in the query (default is '*' for all columns).
-        :param top_k: Number of top similar results to return.
-        :param max_retries: Maximum number of retry attempts.
-        :return: List of tuples containing the top_k similar results.
+        Top-k rows of a vector space (see libraries.db.vector_search.VECTOR_SPACES) nearest to vector.
+
+        metric is "cosine", "l2" or "inner_product"; rows end with their distance (smaller is
+        closer). start_time/end_time filter on the space's time column, device_id on its device
+        column. ef_search/probes tune HNSW/IVFFlat recall for this query only.
         """
-        retries = 0
-        while retries < max_retries:
-            try:
-                # Convert the query vector to a string format suitable for SQL
-                query_vector_str = ','.join(map(str, query_vector))
-                
-                # Construct the SQL query
-                sql_query = f"""
-                    SELECT {columns}, {vector_column} <-> '[{query_vector_str}]' AS similarity
-                    FROM {table_name}
-                    ORDER BY similarity
-                    LIMIT {top_k};
-                """
-                
-                # Create a new cursor for this operation
-                with self.connection.cursor() as cursor:
-                    # Execute the query
-                    cursor.execute(sql_query)
-                    results = cursor.fetchall()
-                
-                return results
-            except Exception as e:
-                retries += 1
-                logging.error(f"Error performing similarity search (attempt {retries}/{max_retries}): {e}")
-                self.connection.rollback()  # Rollback the transaction
-                if retries == max_retries:
-                    logging.error("Max retries reached. Returning empty list.")
-                    return []
-                time.sleep(1)  # Wait for 1 second before retrying
+        sql, params = build_search_query(space, metric, k, columns, start_time, end_time, device_id)
+        params[0] = Vector(vector)
+
+        def search(cursor):
+            for statement in search_settings(ef_search, probes):
+                cursor.execute(statement)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+        return self.run(search)
+
+    def fetch_vectors(self, query, params=None):
+        """
+        Bulk-load embeddings over binary COPY: returns (rows, matrix) where matrix is a contiguous
+        float32 (n, dim) array of the query's last column and rows hold the other columns as text.
+        """
+        return self.run(lambda cursor: copy_vectors(cursor, query, params))
 
     def get_known_classes(self, type='audio'):
         result = self.query("SELECT name, embedding, radius_threshold, embedded_data, id, gotify_priority, ignore FROM known_classes WHERE datatype = %s", (type,))
         
         known_classes = []
         for row in result:
-            if row[1]:  # Check if embedding is not None
-                embedding = [float(x) for x in row[1][1:-1].split(',')]  # Remove brackets and split
-            else:
-                embedding = None
+            embedding = row[1]
+            if isinstance(embedding, str):
+                # pgvector types weren't registered on this connection
+                embedding = vector_from_text(embedding)
             known_classes.append({
                 'name': row[0],
                 'embedding': embedding,
@@ -158,64 +297,51 @@ class DB:
         VALUES (%s, %s, %s);
         """
         self.execute(query, (timestamp, image_data, device_id))
-    def execute_query(self, query, params=None):
-        def run_query():
-            cursor = self.connection.cursor()
-            try:
-                # logging.info(f"Executing query: {query} with params: {params}")
-                cursor.execute(query, params)
-                self.connection.commit()
-                try:
-                    return cursor.fetchall()
-                except psycopg2.ProgrammingError:
-                    # Query was not a SELECT, so no results to fetch
-                    return None
-            except psycopg2.Error as e:
-                if str(e) != 'no results to fetch':
-                    logging.error(f"The error '{e}' occurred")
-                self.connection.rollback()
-            finally:
-                cursor.close()
-
-        thread = threading.Thread(target=run_query)
-        thread.start()
-            
+    def execute_query(self, query, params=None, prepare=False):
+        """
+        Run a statement on the worker pool. Returns a Future with the fetched rows (None on error).
+
+        prepare=True runs it as a cached server-side prepared statement; use it for hot statements.
+        """
+        return self.executor.submit(self._logged_statement, query, params, prepare)
+
+    async def execute_async(self, query, params=None, prepare=False):
+        """
+        Awaitable execute_query for async handlers; the statement still runs on the worker pool.
+        When the pool's queue is full this awaits a free slot instead of blocking the event loop.
+        """
+        return await (await self.executor.submit_async(self._logged_statement, query, params, prepare))
+
+    def _logged_statement(self, query, params=None, prepare=False):
+        try:
+            # logging.info(f"Executing query: {query} with params: {params}")
+            return self.run(self._statement(query, params, prepare))
+        except psycopg2.Error as e:
+            logging.error(f"The error '{e}' occurred")
             
-    def sync_query(self, query, params=None):
+    def sync_query(self, query, params=None, prepare=False):
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params)
-            try:
-                result = cursor.fetchall()
-                return result
-            except psycopg2.ProgrammingError:
-                # Query was not a SELECT, so no results to fetch
-                return None
+            return self.run(self._statement(query, params, prepare))
         except psycopg2.Error as e:
-            if str(e) != 'no results to fetch':
-                print(f"The error '{e}' occurred")
-            self.connection.rollback()
+            print(f"The error '{e}' occurred")
             return None
-        finally:
-            cursor.close()
+
     def close_connection(self):
-        if self.connection:
-            self.connection.close()
-            print("The connection is closed")
+        if self._write_buffer is not None:
+            self._write_buffer.close()
+        self.executor.shutdown(wait=True)
+        if self._connection is not None:
+            self._release(self._connection)
+            self._connection = None
+        self.pool.closeall()
+        print("The connection is closed")
 
-    def insert_gps_data(self, latitude, longitude, altitude, time, device_id):
-        query = """
-        INSERT INTO gps_data (latitude, longitude, altitude, time, device_id)
-        VALUES (%s, %s, %s, %s, %s);
-        """
-        self.execute_query(query, (latitude, longitude, altitude, time, device_id))
+    def insert_gps_data(self, latitude, longitude, altitude, time, device_id, timeout=None):
+        # timeout bounds how long a full write buffer may block the caller; the row is dropped after it
+        return self.write_buffer.add("gps_data", ("latitude", "longitude", "altitude", "time", "device_id"), (latitude, longitude, altitude, time, device_id), timeout=timeout)
 
-    def insert_sensor_data(self, sensor_type, x, y, z, device_id):
-        query = """
-        INSERT INTO sensor_data (sensor_type, x, y, z, device_id)
-        VALUES (%s, %s, %s, %s, %s);
-        """
-        self.execute_query(query, (sensor_type, x, y, z, device_id))
+    def insert_sensor_data(self, sensor_type, x, y, z, device_id, timeout=None):
+        return self.write_buffer.add("sensor_data", ("sensor_type", "x", "y", "z", "device_id"), (sensor_type, x, y, z, device_id), timeout=timeout)
         
 
     def insert_app_usage_stats(self, package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used):
@@ -223,49 +349,40 @@ class DB:
         SELECT id FROM app_usage_stats 
         WHERE package_name = %s AND DATE(created_at) = DATE(NOW());
         """
-        cursor = self.connection.cursor()
-        cursor.execute(check_query, (package_name,))
-        existing_record = cursor.fetchone()
-        
-        if existing_record:
-            update_query = """
-            UPDATE app_usage_stats
-            SET total_time_in_foreground = %s, first_timestamp = %s, last_timestamp = %s, last_time_used = %s, last_time_visible = %s, last_time_foreground_service_used = %s, total_time_visible = %s, total_time_foreground_service_used = %s
-            WHERE id = %s;
-            """
-            cursor.execute(update_query, (total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used, existing_record[0]))
-        else:
-            insert_query = """
-            INSERT INTO app_usage_stats (package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-            cursor.execute(insert_query, (package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used))
-        
-        self.connection.commit()
-        cursor.close()
+        def upsert(cursor):
+            cursor.execute(check_query, (package_name,))
+            existing_record = cursor.fetchone()
+            
+            if existing_record:
+                update_query = """
+                UPDATE app_usage_stats
+                SET total_time_in_foreground = %s, first_timestamp = %s, last_timestamp = %s, last_time_used = %s, last_time_visible = %s, last_time_foreground_service_used = %s, total_time_visible = %s, total_time_foreground_service_used = %s
+                WHERE id = %s;
+                """
+                cursor.execute(update_query, (total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used, existing_record[0]))
+            else:
+                insert_query = """
+                INSERT INTO app_usage_stats (package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+                """
+                cursor.execute(insert_query, (package_name, total_time_in_foreground, first_timestamp, last_timestamp, last_time_used, last_time_visible, last_time_foreground_service_used, total_time_visible, total_time_foreground_service_used))
+
+        self.run(upsert)
 
         
 
     def insert_key_event_data(self, keyCode, action):
-        query = """
-        INSERT INTO key_event_data (keyCode, action)
-        VALUES (%s, %s);
-        """
-        self.execute_query(query, (keyCode, action))
+        self.write_buffer.add("key_event_data", ("keyCode", "action"), (keyCode, action))
 
     def insert_motion_event_data(self, x, y, action):
-        query = """
-        INSERT INTO motion_event_data (x, y, action)
-        VALUES (%s, %s, %s);
-        """
-        self.execute_query(query, (x, y, action))
+        self.write_buffer.add("motion_event_data", ("x", "y", "action"), (x, y, action))
 
     def insert_notification_data(self, data):
         query = """
         INSERT INTO notification_data (data)
         VALUES (%s);
         """
-        self.execute_query(query, (data,))
+        self.execute_query(query, (data,), prepare=True)
 
     def insert_audio_data(self, taken_at, data, device_id):
         query = """
@@ -273,33 +390,28 @@ class DB:
         VALUES (%s, %s, %s)
         RETURNING id;
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, (taken_at, data, device_id))
-        row_id = cursor.fetchone()[0]
-        self.connection.commit()
-        cursor.close()
-        return row_id
+        return self.run(self._statement(query, (taken_at, data, device_id), prepare=True))[0][0]
 
     def insert_speech_data(self, text, result, started_at, ended_at, device_id):
         query = """
         INSERT INTO speech_data (text, result, started_at, ended_at, device_id)
         VALUES (%s, %s::json, %s, %s, %s);
         """
-        self.execute_query(query, (text, result, started_at, ended_at, device_id))
+        self.execute_query(query, (text, result, started_at, ended_at, device_id), prepare=True)
         
     def insert_manual_photo_data(self, photo, is_screenshot, device_id):
         query = """
         INSERT INTO manual_photo_data (photo, is_screenshot, device_id)
         VALUES (%s, %s, %s);
         """
-        self.execute_query(query, (photo, is_screenshot, device_id))
+        self.execute_query(query, (photo, is_screenshot, device_id), prepare=True)
         
     def insert_screenshot_data(self, data, device_id):
         query = """
         INSERT INTO screenshot_data (data, device_id)
         VALUES (%s, %s);
         """
-        self.execute_query(query, (data, device_id))
+        self.execute_query(query, (data, device_id), prepare=True)
     
     def update_screenshot_data(self, id, clip):
         query = """
@@ -307,31 +419,27 @@ class DB:
         SET clip = %s
         WHERE id = %s;
         """
-        self.execute_query(query, (clip, id))
+        self.execute_query(query, (clip, id), prepare=True)
 
     def insert_websocket_metadata(self, connected_at, disconnected_at, client_ip, client_user_agent, status):
         query = """
         INSERT INTO websocket_metadata (connected_at, disconnected_at, client_ip, client_user_agent, status)
         VALUES (%s, %s, %s, %s, %s);
         """
-        self.execute_query(query, (connected_at, disconnected_at, client_ip, client_user_agent, status))
+        self.execute_query(query, (connected_at, disconnected_at, client_ip, client_user_agent, status), prepare=True)
 
     def email_exists(self, email_id):
         query = """
         SELECT 1 FROM email_data WHERE email_id = %s;
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, (email_id,))
-        exists = cursor.fetchone() is not None
-        cursor.close()
-        return exists
+        return bool(self.query(query, (email_id,), prepare=True))
 
     def insert_email_data(self, email_id, subject, sender, received_at, body, attachments_bytea, seen, receiver):
         query = """
         INSERT INTO email_data (email_id, subject, sender, received_at, body, attachments, seen, receiver)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
         """
-        self.execute_query(query, (email_id, subject, sender, received_at, body, attachments_bytea, seen, receiver))
+        self.execute_query(query, (email_id, subject, sender, received_at, body, attachments_bytea, seen, receiver), prepare=True)
 
     def insert_calendar_data(self, event_data):
         query = """
@@ -345,17 +453,13 @@ class DB:
             event_data['end'], 
             event_data['description'], 
             event_data['location']
-        ))
+        ), prepare=True)
 
     def event_exists(self, event_id):
         query = """
         SELECT 1 FROM event_data WHERE event_id = %s;
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, (event_id,))
-        exists = cursor.fetchone() is not None
-        cursor.close()
-        return exists
+        return bool(self.query(query, (event_id,), prepare=True))
 
     def insert_browser_data(self, data):
         query = """
@@ -373,7 +477,7 @@ class DB:
             data['incognito'], data['index'], data['lastAccessed'], json.dumps(data['mutedInfo']), 
             data['pinned'], data['selected'], data['status'], data['title'], data['url'], data['width'], 
             data['windowId'], data['type'], data['useragent']
-        ))
+        ), prepare=True)
         
     def insert_server_stats(self, stat, device_id):
         query = """
@@ -387,5 +491,5 @@ class DB:
             json.dumps(stat['ram_usage']), 
             json.dumps(stat['gpu_usage']),
             device_id
-        ))
+        ), prepare=True)
     
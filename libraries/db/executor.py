@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BoundedExecutor:
+    """
+    Fixed-size thread pool whose backlog is capped.
+
+    ThreadPoolExecutor queues without limit, so a burst of inserts would grow memory
+    unbounded. submit() here blocks once max_workers + max_queue calls are in flight;
+    coroutines use submit_async(), which waits for a slot without blocking the event loop.
+    """
+
+    def __init__(self, max_workers, max_queue, thread_name_prefix="db-worker"):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        return self._submit_acquired(fn, *args, **kwargs)
+
+    async def submit_async(self, fn, *args, **kwargs):
+        """submit() for coroutines: awaits a free slot, then returns an asyncio future for fn's result."""
+        if not self._slots.acquire(blocking=False):
+            waiter = asyncio.get_running_loop().run_in_executor(None, self._slots.acquire)
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # The slot is taken once the blocked acquire returns; hand it straight back
+                waiter.add_done_callback(lambda _: self._slots.release())
+                raise
+        return asyncio.wrap_future(self._submit_acquired(fn, *args, **kwargs))
+
+    def _submit_acquired(self, fn, *args, **kwargs):
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
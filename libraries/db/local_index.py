@@ -0,0 +1,450 @@
+"""
+In-process approximate nearest-neighbour mirror of the embedding columns in VECTOR_SPACES.
+
+Each space lives in its own directory of flat, memory-mapped files:
+
+    ids.u8          16 byte UUIDs (ids are UUIDv7, so byte order is insertion order)
+    vectors.f32     L2-normalized float32 embeddings, one row per id
+    times.f64       the space's time column as epoch seconds (NaN when NULL)
+    devices.i4      the space's device column (-1 when NULL or when the space has none)
+    centroids.f32   IVF list centroids for the first `built` rows
+    offsets.i8      row range of each IVF list within the first `built` rows
+    meta.json       dimension, row count, built count and the highest synced id
+
+Rows up to `built` are grouped by IVF list, so a search scores only the lists nearest the
+query. Rows appended by sync() after that form a tail that is always scanned exactly; once the
+tail gets large the lists are re-clustered locally. Distances are cosine distances, the same
+as the pgvector <=> operator. Rebuild a space from the database with
+
+    python -m libraries.db.local_index rebuild [--space image_data]
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+
+from libraries.db.vector_search import VECTOR_SPACES, get_space, quote_identifier
+
+FORMAT_VERSION = 1
+# Below this many rows an exact scan is already fast, so no IVF lists are built
+MIN_LIST_ROWS = 4096
+# Filters matching at most this many rows are answered by scoring just those rows
+EXACT_FILTER_ROWS = 8192
+# Rows appended since the last build, relative to the built rows, that trigger re-clustering
+COMPACT_RATIO = 0.25
+
+ROW_FILES = {
+    "ids": ("ids.u8", np.uint8),
+    "vectors": ("vectors.f32", np.float32),
+    "times": ("times.f64", np.float64),
+    "devices": ("devices.i4", np.int32),
+}
+
+
+def _fetch_sql(space):
+    vector_space = get_space(space)
+    device = f"{quote_identifier(vector_space.device_column)}::text" if vector_space.device_column else "NULL"
+    return f"""
+    SELECT id::text, EXTRACT(EPOCH FROM {quote_identifier(vector_space.time_column)})::text, {device}, {quote_identifier(vector_space.column)}
+    FROM public.{quote_identifier(vector_space.table)}
+    WHERE id > %s::uuid AND {quote_identifier(vector_space.column)} IS NOT NULL
+    ORDER BY id
+    """
+
+
+def _uuid_floor(epoch_seconds):
+    """Smallest UUIDv7 generated at or after epoch_seconds."""
+    return uuid.UUID(bytes=int(epoch_seconds * 1000).to_bytes(6, "big") + bytes(10))
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if value.tzinfo is None:
+        # Naive datetimes are UTC, like the rest of the readers
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _id_keys(ids):
+    """(n, 16) uint8 UUID bytes -> (hi, lo) big-endian halves, for ordered comparisons."""
+    halves = np.ascontiguousarray(ids).view(">u8").reshape(-1, 2)
+    return halves[:, 0], halves[:, 1]
+
+
+def _assign(vectors, centroids, chunk=65536):
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        assignments[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return assignments
+
+
+def _kmeans(vectors, lists, iterations=10, sample_per_list=64, seed=0):
+    """Spherical k-means on a sample of the rows; returns normalized (lists, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), lists * sample_per_list)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        filled = np.bincount(assignments, minlength=lists) > 0
+        # Empty lists keep their previous centroid
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+
+@dataclass
+class _Snapshot:
+    count: int
+    built: int
+    ids: np.ndarray
+    vectors: np.ndarray
+    times: np.ndarray
+    devices: np.ndarray
+    centroids: np.ndarray
+    offsets: np.ndarray
+
+
+class SpaceIndex:
+    """
+    The local index of one vector space. Searches read an immutable snapshot of the mapped
+    files and never take the lock; sync() and rebuild() serialize on it and swap in a new
+    snapshot when done.
+    """
+
+    def __init__(self, directory, space, n_probe=16, pending_seconds=600):
+        self.space = space
+        self.vector_space = get_space(space)
+        self.directory = directory
+        self.n_probe = n_probe
+        # Rows this recent are re-checked on every sync, since embeddings are often set by a
+        # later UPDATE (e.g. image_data.image_embedding)
+        self.pending_seconds = pending_seconds
+        self.meta = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._recover()
+        self._load()
+
+    def _path(self, name, directory=None):
+        return os.path.join(directory or self.directory, name)
+
+    def _recover(self):
+        # A rebuild died between moving the old index aside and moving the new one in
+        old = self.directory + ".old"
+        if not os.path.exists(self.directory) and os.path.exists(old):
+            os.rename(old, self.directory)
+        shutil.rmtree(self.directory + ".building", ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("version") != FORMAT_VERSION or meta.get("space") != self.space:
+                logging.warning(f"Ignoring local vector index {self.directory} with a different format")
+                meta = None
+        if meta is None:
+            self.meta = {"version": FORMAT_VERSION, "space": self.space, "dim": 0, "count": 0, "built": 0, "lists": 0, "watermark": None}
+            self._snapshot = _Snapshot(
+                0, 0, np.empty((0, 16), np.uint8), np.empty((0, 0), np.float32), np.empty(0, np.float64),
+                np.empty(0, np.int32), np.empty((0, 0), np.float32), np.zeros(2, np.int64)
+            )
+            return
+
+        count, dim = meta["count"], meta["dim"]
+        row_shapes = {"ids": (16,), "vectors": (dim,), "times": (), "devices": ()}
+        arrays = {}
+        for name, (filename, dtype) in ROW_FILES.items():
+            path = self._path(filename)
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shapes[name], dtype=np.int64))
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < count * row_bytes:
+                logging.error(f"Local vector index {self.directory} is missing rows in {filename}; it will be rebuilt")
+                self.meta = None
+                shutil.rmtree(self.directory, ignore_errors=True)
+                return self._load()
+            if size > count * row_bytes:
+                # Rows appended by a sync that died before meta.json was updated
+                with open(path, "r+b") as f:
+                    f.truncate(count * row_bytes)
+            # Plain ndarray views of the maps; np.memmap's per-slice bookkeeping shows up in search latency
+            arrays[name] = np.asarray(np.memmap(path, dtype=dtype, mode="r", shape=(count,) + row_shapes[name])) if count else np.empty((0,) + row_shapes[name], dtype)
+
+        centroids = np.fromfile(self._path("centroids.f32"), dtype=np.float32).reshape(-1, dim) if meta["lists"] else np.empty((0, dim), np.float32)
+        offsets = np.fromfile(self._path("offsets.i8"), dtype=np.int64) if meta["lists"] else np.array([0, meta["built"]], np.int64)
+        self.meta = meta
+        self._snapshot = _Snapshot(count, meta["built"], arrays["ids"], arrays["vectors"], arrays["times"], arrays["devices"], centroids, offsets)
+
+    def _write_meta(self, meta, directory=None):
+        path = self._path("meta.json", directory)
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def search(self, vector, k=10, start_time=None, end_time=None, device_id=None, n_probe=None):
+        """
+        Top-k (id, cosine distance) pairs nearest to vector, closest first. start_time/end_time
+        (datetimes or epoch seconds) filter on the space's time column, device_id on its device column.
+        """
+        snapshot = self._snapshot
+        if snapshot.count == 0:
+            return []
+        if device_id is not None and self.vector_space.device_column is None:
+            raise ValueError(f"Vector space {self.space!r} has no device column")
+        query = _normalize(vector).reshape(-1)
+
+        mask = None
+        start_time, end_time = _epoch(start_time), _epoch(end_time)
+        if start_time is not None or end_time is not None or device_id is not None:
+            mask = np.ones(snapshot.count, dtype=bool)
+            if start_time is not None:
+                mask &= snapshot.times >= start_time
+            if end_time is not None:
+                mask &= snapshot.times < end_time
+            if device_id is not None:
+                mask &= snapshot.devices == int(device_id)
+
+        if mask is not None and np.count_nonzero(mask) <= max(EXACT_FILTER_ROWS, k):
+            rows = np.flatnonzero(mask)
+            scores = snapshot.vectors[rows] @ query
+        else:
+            ranges = self._candidate_ranges(snapshot, query, n_probe or self.n_probe)
+            rows = np.concatenate([np.arange(lo, hi) for lo, hi in ranges])
+            scores = np.concatenate([snapshot.vectors[lo:hi] @ query for lo, hi in ranges])
+            if mask is not None:
+                keep = mask[rows]
+                rows, scores = rows[keep], scores[keep]
+                if len(rows) < k:
+                    # The probed lists held too few matching rows; score every match instead
+                    rows = np.flatnonzero(mask)
+                    scores = snapshot.vectors[rows] @ query
+
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores)
+        return [
+            (str(uuid.UUID(bytes=snapshot.ids[row].tobytes())), float(1.0 - score))
+            for row, score in zip(rows[order], scores[order])
+        ]
+
+    @staticmethod
+    def _candidate_ranges(snapshot, query, n_probe):
+        ranges = []
+        if len(snapshot.centroids) and n_probe < len(snapshot.centroids):
+            probed = np.argpartition(-(snapshot.centroids @ query), n_probe - 1)[:n_probe]
+            ranges.extend((snapshot.offsets[i], snapshot.offsets[i + 1]) for i in np.sort(probed))
+        elif snapshot.built:
+            ranges.append((0, snapshot.built))
+        if snapshot.count > snapshot.built:
+            ranges.append((snapshot.built, snapshot.count))
+        return [(int(lo), int(hi)) for lo, hi in ranges if hi > lo] or [(0, 0)]
+
+    @staticmethod
+    def _parse(rows, matrix):
+        ids = np.frombuffer(b"".join(uuid.UUID(row[0]).bytes for row in rows), dtype=np.uint8).reshape(-1, 16)
+        times = np.array([float(row[1]) if row[1] is not None else np.nan for row in rows], dtype=np.float64)
+        devices = np.array([int(row[2]) if row[2] is not None else -1 for row in rows], dtype=np.int32)
+        return ids, _normalize(matrix), times, devices
+
+    def rebuild(self, db):
+        """Reload every row of the space from the database and re-cluster it."""
+        with self._lock:
+            rows, matrix = db.fetch_vectors(_fetch_sql(self.space), (str(uuid.UUID(int=0)),))
+            ids, vectors, times, devices = self._parse(rows, matrix)
+            self._build(ids, vectors, times, devices, rows[-1][0] if rows else None)
+        logging.info(f"Rebuilt local vector index for {self.space}: {len(ids)} rows")
+
+    def sync(self, db):
+        """Append rows inserted (or given an embedding) since the last sync. Returns rows added."""
+        if self.meta["watermark"] is None:
+            self.rebuild(db)
+            return len(self)
+
+        with self._lock:
+            watermark = self.meta["watermark"]
+            lower = min(uuid.UUID(watermark), _uuid_floor(time.time() - self.pending_seconds))
+            rows, matrix = db.fetch_vectors(_fetch_sql(self.space), (str(lower),))
+            if not rows:
+                return 0
+            ids, vectors, times, devices = self._parse(rows, matrix)
+            if self.meta["dim"] and vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"{self.space} embeddings changed dimension from {self.meta['dim']} to {vectors.shape[1]}; rebuild the index")
+
+            # Rows at or after the lower bound may already be indexed
+            snapshot = self._snapshot
+            lower_hi, lower_lo = _id_keys(np.frombuffer(lower.bytes, dtype=np.uint8).reshape(1, 16))
+            hi, lo = _id_keys(snapshot.ids)
+            recent = (hi > lower_hi[0]) | ((hi == lower_hi[0]) & (lo > lower_lo[0]))
+            known = {snapshot.ids[row].tobytes() for row in np.flatnonzero(recent)}
+            new = np.array([row.tobytes() not in known for row in ids], dtype=bool)
+            watermark = max(uuid.UUID(watermark), uuid.UUID(rows[-1][0]))
+            if not new.any():
+                self.meta = dict(self.meta, watermark=str(watermark))
+                self._write_meta(self.meta)
+                return 0
+            ids, vectors, times, devices = ids[new], vectors[new], times[new], devices[new]
+
+            count = snapshot.count + len(ids)
+            tail = count - snapshot.built
+            if count >= MIN_LIST_ROWS and tail > snapshot.built * COMPACT_RATIO:
+                self._build(
+                    np.concatenate([snapshot.ids, ids]), np.concatenate([snapshot.vectors, vectors]),
+                    np.concatenate([snapshot.times, times]), np.concatenate([snapshot.devices, devices]),
+                    str(watermark)
+                )
+            else:
+                for name, array in (("ids", ids), ("vectors", vectors), ("times", times), ("devices", devices)):
+                    with open(self._path(ROW_FILES[name][0]), "ab") as f:
+                        f.write(np.ascontiguousarray(array, dtype=ROW_FILES[name][1]).tobytes())
+                self._write_meta(dict(self.meta, dim=vectors.shape[1], count=count, watermark=str(watermark)))
+                self._load()
+            return len(ids)
+
+    def _build(self, ids, vectors, times, devices, watermark):
+        count = len(ids)
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        lists = int(math.sqrt(count)) if count >= MIN_LIST_ROWS else 0
+        if lists:
+            centroids = _kmeans(vectors, lists)
+            assignments = _assign(vectors, centroids)
+            order = np.argsort(assignments, kind="stable")
+            ids, vectors, times, devices = ids[order], vectors[order], times[order], devices[order]
+            offsets = np.searchsorted(assignments[order], np.arange(lists + 1)).astype(np.int64)
+
+        building = self.directory + ".building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        for name, array in (("ids", ids), ("vectors", vectors), ("times", times), ("devices", devices)):
+            np.ascontiguousarray(array, dtype=ROW_FILES[name][1]).tofile(self._path(ROW_FILES[name][0], building))
+        if lists:
+            centroids.astype(np.float32).tofile(self._path("centroids.f32", building))
+            offsets.tofile(self._path("offsets.i8", building))
+        self._write_meta({
+            "version": FORMAT_VERSION, "space": self.space, "dim": dim, "count": count,
+            "built": count, "lists": lists, "watermark": watermark
+        }, building)
+
+        old = self.directory + ".old"
+        if os.path.exists(self.directory):
+            os.rename(self.directory, old)
+        os.rename(building, self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+        self._load()
+
+
+class LocalVectorIndex:
+    """
+    Local indexes for several vector spaces under one directory, kept up to date with the
+    database by a background thread every refresh_interval seconds (see start()).
+    """
+
+    def __init__(self, directory, db, spaces=None, refresh_interval=30, n_probe=16):
+        self.directory = directory
+        self.db = db
+        self.refresh_interval = refresh_interval
+        os.makedirs(directory, exist_ok=True)
+        self.indexes = {
+            space: SpaceIndex(os.path.join(directory, space), space, n_probe=n_probe)
+            for space in (spaces or VECTOR_SPACES)
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+    def index(self, space):
+        if space not in self.indexes:
+            raise ValueError(f"Vector space {space!r} is not indexed locally, expected one of {sorted(self.indexes)}")
+        return self.indexes[space]
+
+    def search(self, space, vector, k=10, start_time=None, end_time=None, device_id=None, n_probe=None):
+        return self.index(space).search(vector, k, start_time, end_time, device_id, n_probe)
+
+    def sync(self, spaces=None):
+        added = {}
+        for space in spaces or self.indexes:
+            try:
+                added[space] = self.index(space).sync(self.db)
+            except Exception as e:
+                logging.error(f"Error syncing local vector index for {space}: {e}")
+        return added
+
+    def rebuild(self, spaces=None):
+        for space in spaces or self.indexes:
+            self.index(space).rebuild(self.db)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            added = self.sync()
+            if any(added.values()):
+                logging.info(f"Local vector index synced: {added}")
+            self._stop.wait(self.refresh_interval)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local ANN mirror of the embedding columns")
+    parser.add_argument("action", choices=("rebuild", "sync", "stats"))
+    parser.add_argument("--space", action="append", choices=sorted(VECTOR_SPACES), help="Default: all spaces")
+    parser.add_argument("--directory", default=os.getenv("LOCAL_VECTOR_INDEX_DIR", "vector_index"))
+    args = parser.parse_args(argv)
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from libraries.db.db import DB
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = DB(
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        database=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        max_connections=1
+    )
+    try:
+        local_index = LocalVectorIndex(args.directory, db, args.space)
+        if args.action == "rebuild":
+            local_index.rebuild()
+        elif args.action == "sync":
+            logging.info(f"Rows added: {local_index.sync()}")
+        for space, index in local_index.indexes.items():
+            print(space, len(index), f"built={index.meta['built']}", f"lists={index.meta['lists']}", f"watermark={index.meta['watermark']}", sep="\t")
+    finally:
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
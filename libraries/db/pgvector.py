@@ -0,0 +1,126 @@
+import io
+import struct
+import numpy as np
+import psycopg2.extensions
+
+# pgvector's binary representation (vector_send/vector_recv): uint16 dim, uint16 unused,
+# then dim big-endian float4 values
+VECTOR_HEADER = struct.Struct(">HH")
+VECTOR_DTYPE = np.dtype(">f4")
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = struct.Struct(">II")
+COPY_FIELD_COUNT = struct.Struct(">h")
+COPY_FIELD_LENGTH = struct.Struct(">i")
+
+
+def encode_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return VECTOR_HEADER.pack(len(vector), 0) + vector.astype(VECTOR_DTYPE).tobytes()
+
+
+def decode_vector(data, offset=0):
+    dim, _ = VECTOR_HEADER.unpack_from(data, offset)
+    return np.frombuffer(data, dtype=VECTOR_DTYPE, count=dim, offset=offset + VECTOR_HEADER.size).astype(np.float32)
+
+
+def vector_to_text(vector):
+    return "[" + ",".join(map(repr, np.asarray(vector, dtype=np.float32).reshape(-1).tolist())) + "]"
+
+
+def vector_from_text(text, cursor=None):
+    if text is None:
+        return None
+    # Parsed in C by NumPy instead of one Python float() per element
+    return np.fromstring(text[1:-1], dtype=np.float32, sep=",")
+
+
+class Vector:
+    """Wraps a 1-D array so psycopg2 sends it as a vector literal instead of an array."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def __conform__(self, protocol):
+        if protocol is psycopg2.extensions.ISQLQuote:
+            return self
+
+    def getquoted(self):
+        return f"'{vector_to_text(self.values)}'::vector".encode("ascii")
+
+
+def register_vector_psycopg2(cursor):
+    """Return vector columns as float32 NumPy arrays on every psycopg2 connection. False without pgvector."""
+    cursor.execute("SELECT oid, typarray FROM pg_type WHERE typname = 'vector'")
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    vector_type = psycopg2.extensions.new_type((row[0],), "VECTOR", vector_from_text)
+    psycopg2.extensions.register_type(vector_type)
+    if row[1]:
+        psycopg2.extensions.register_type(psycopg2.extensions.new_array_type((row[1],), "VECTOR[]", vector_type))
+    return True
+
+
+async def register_vector_asyncpg(connection):
+    """Binary vector codec for an asyncpg connection: NumPy arrays in, float32 arrays out."""
+    await connection.set_type_codec(
+        "vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary"
+    )
+
+
+def copy_vectors(cursor, query, params=None):
+    """
+    Run query through binary COPY and return (rows, matrix).
+
+    The last selected column must be a vector; it is decoded straight into row i of a
+    contiguous float32 (n, dim) matrix. Rows with a NULL vector are skipped. The other
+    columns come back in rows as text, so select them as ::text.
+    """
+    if params is not None:
+        query = cursor.mogrify(query, params).decode(psycopg2.extensions.encodings[cursor.connection.encoding])
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    data = buffer.getbuffer()
+
+    if bytes(data[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError("Unexpected COPY BINARY signature")
+    offset = len(COPY_SIGNATURE)
+    _, extension_length = COPY_HEADER.unpack_from(data, offset)
+    offset += COPY_HEADER.size + extension_length
+
+    rows = []
+    vector_offsets = []
+    dim = None
+    while True:
+        (field_count,) = COPY_FIELD_COUNT.unpack_from(data, offset)
+        offset += COPY_FIELD_COUNT.size
+        if field_count == -1:
+            break
+        fields = []
+        vector_offset = None
+        for index in range(field_count):
+            (length,) = COPY_FIELD_LENGTH.unpack_from(data, offset)
+            offset += COPY_FIELD_LENGTH.size
+            if length == -1:
+                fields.append(None)
+                continue
+            if index == field_count - 1:
+                vector_offset = offset
+            else:
+                fields.append(bytes(data[offset:offset + length]).decode("utf-8"))
+            offset += length
+        if vector_offset is None:
+            continue
+        row_dim, _ = VECTOR_HEADER.unpack_from(data, vector_offset)
+        if dim is None:
+            dim = row_dim
+        elif row_dim != dim:
+            raise ValueError(f"Mixed vector dimensions in COPY result: {dim} and {row_dim}")
+        rows.append(tuple(fields))
+        vector_offsets.append(vector_offset + VECTOR_HEADER.size)
+
+    matrix = np.empty((len(vector_offsets), dim or 0), dtype=np.float32)
+    for row_index, vector_offset in enumerate(vector_offsets):
+        matrix[row_index] = np.frombuffer(data, dtype=VECTOR_DTYPE, count=dim, offset=vector_offset)
+    return rows, matrix
@@ -0,0 +1,100 @@
+import re
+import threading
+import itertools
+import weakref
+from collections import OrderedDict
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+
+def to_server_placeholders(query):
+    """Rewrite psycopg2 %s placeholders as $1, $2 ... Returns the new SQL and the placeholder count."""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(0) == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(replace, query), count
+
+
+class StatementCache:
+    """
+    Server-side prepared statements, cached per connection with LRU eviction.
+
+    The first execution of a SQL text on a connection runs PREPARE; later executions on the
+    same connection only send EXECUTE with the parameters, so the server skips parse and plan.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Keyed by the connection object, not id(): connections the pool closes on its own drop
+        # out with their cache, and a new connection can never inherit a stale one
+        self._caches = weakref.WeakKeyDictionary()
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+
+    def execute(self, cursor, query, params=None):
+        params = tuple(params or ())
+        # Named placeholders are not rewritten; run those as plain statements
+        if "%(" in query:
+            return cursor.execute(query, params)
+        name = self._prepare(cursor, query, len(params))
+        if name is None:
+            return cursor.execute(query, params or None)
+        if params:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def _prepare(self, cursor, query, param_count):
+        # A connection is only ever used by one thread at a time, so its own cache needs no lock
+        connection = cursor.connection
+        cache = self._caches.get(connection)
+        if cache is None:
+            cache = self._caches[connection] = OrderedDict()
+        name = cache.get(query)
+        if name is not None:
+            cache.move_to_end(query)
+            with self._lock:
+                self.hits += 1
+            return name
+
+        if param_count:
+            server_query, placeholder_count = to_server_placeholders(query)
+        else:
+            # Without parameters psycopg2 sends the text as is, % included
+            server_query, placeholder_count = query, 0
+        if placeholder_count != param_count:
+            return None
+
+        with self._lock:
+            self.misses += 1
+            name = f"pino_stmt_{next(self._names)}"
+        cursor.execute(f"PREPARE {name} AS {server_query.strip().rstrip(';')}")
+        cache[query] = name
+        if len(cache) > self.max_size:
+            _, evicted = cache.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+            with self._lock:
+                self.evictions += 1
+        return name
+
+    def forget(self, connection):
+        """Drop the cache of a connection that was closed or discarded."""
+        self._caches.pop(connection, None)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "connections": len(self._caches),
+            "statements": sum(len(cache) for cache in list(self._caches.values())),
+        }
@@ -0,0 +1,184 @@
+"""
+Top-k vector search over the embedding columns, and management of their ANN indexes.
+
+Searches are ORDER BY <column> <op> <vector> LIMIT k with the vector passed as a parameter,
+so pgvector can answer them from an HNSW or IVFFlat index on the column. Create the indexes with
+
+    python -m libraries.db.vector_search create [--method hnsw|ivfflat] [--metric cosine|l2|inner_product]
+"""
+import argparse
+import logging
+import os
+import sys
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class VectorSpace:
+    table: str
+    column: str
+    time_column: str
+    device_column: str = None
+    columns: tuple = ("id",)
+
+
+VECTOR_SPACES = {
+    "emails": VectorSpace("emails", "embedding", "date_received", None, ("id", "subject", "sender", "date_received")),
+    "tweets": VectorSpace("tweets", "text_embedding", "timestamp", None, ("id", "tweet_text", "tweet_url", "timestamp")),
+    "documents": VectorSpace("documents", "embedding", "created_at", None, ("id", "name", "created_at")),
+    "image_data": VectorSpace("image_data", "image_embedding", "created_at", "device_id", ("id", "device_id", "created_at", "is_screenshot")),
+    "llm_memories": VectorSpace("llm_memories", "embedding", "created_at", "device_id", ("id", "content", "created_at", "metadata")),
+    "known_class_detections": VectorSpace("known_class_detections", "embedding", "created_at", None, ("id", "known_class_id", "created_at")),
+}
+
+# Metric -> (distance operator, operator class). Smaller distance is closer for all three;
+# pgvector's <#> is the negative inner product.
+METRICS = {
+    "cosine": ("<=>", "vector_cosine_ops"),
+    "l2": ("<->", "vector_l2_ops"),
+    "inner_product": ("<#>", "vector_ip_ops"),
+}
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_space(space):
+    if space not in VECTOR_SPACES:
+        raise ValueError(f"Unknown vector space {space!r}, expected one of {sorted(VECTOR_SPACES)}")
+    return VECTOR_SPACES[space]
+
+
+def build_search_query(space, metric="cosine", k=10, columns=None, start_time=None, end_time=None, device_id=None, placeholder="%s"):
+    """
+    Build the top-k query for a vector space. Returns (sql, params) with None where the query
+    vector goes; placeholder is "%s" for psycopg2 or "$" for asyncpg-style $n parameters.
+    """
+    vector_space = get_space(space)
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {sorted(METRICS)}")
+    if device_id is not None and vector_space.device_column is None:
+        raise ValueError(f"Vector space {space!r} has no device column")
+    operator, _ = METRICS[metric]
+
+    params = []
+
+    def param(value):
+        params.append(value)
+        return "%s" if placeholder == "%s" else f"${len(params)}"
+
+    column = quote_identifier(vector_space.column)
+    # Allocated first so positional %s parameters stay in text order
+    vector_param = param(None)
+    conditions = [f"{column} IS NOT NULL"]
+    if start_time is not None:
+        conditions.append(f"{quote_identifier(vector_space.time_column)} >= {param(start_time)}")
+    if end_time is not None:
+        conditions.append(f"{quote_identifier(vector_space.time_column)} < {param(end_time)}")
+    if device_id is not None:
+        conditions.append(f"{quote_identifier(vector_space.device_column)} = {param(device_id)}")
+    select_columns = ", ".join(quote_identifier(name) for name in (columns or vector_space.columns))
+
+    # Ordering by the distance alias is ordering by the operator expression, which is what lets
+    # the planner use an index on the column
+    sql = f"""
+    SELECT {select_columns}, {column} {operator} {vector_param} AS distance
+    FROM public.{quote_identifier(vector_space.table)}
+    WHERE {' AND '.join(conditions)}
+    ORDER BY distance
+    LIMIT {int(k)}
+    """
+    return sql, params
+
+
+def search_settings(ef_search=None, probes=None):
+    """SET LOCAL statements for index recall/speed knobs; run them in the search's transaction."""
+    statements = []
+    if ef_search:
+        statements.append(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+    if probes:
+        statements.append(f"SET LOCAL ivfflat.probes = {int(probes)}")
+    return statements
+
+
+def index_name(space, method, metric):
+    vector_space = get_space(space)
+    return f"idx_{vector_space.table}_{vector_space.column}_{method}_{metric}"
+
+
+def create_index_sql(space, method="hnsw", metric="cosine", m=16, ef_construction=64, lists=100):
+    vector_space = get_space(space)
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index method {method!r}, expected one of {INDEX_METHODS}")
+    _, operator_class = METRICS[metric]
+    options = f"m = {int(m)}, ef_construction = {int(ef_construction)}" if method == "hnsw" else f"lists = {int(lists)}"
+    return f"""
+    CREATE INDEX IF NOT EXISTS {quote_identifier(index_name(space, method, metric))}
+    ON public.{quote_identifier(vector_space.table)}
+    USING {method} ({quote_identifier(vector_space.column)} {operator_class})
+    WITH ({options})
+    """
+
+
+def drop_index_sql(space, method="hnsw", metric="cosine"):
+    return f"DROP INDEX IF EXISTS public.{quote_identifier(index_name(space, method, metric))}"
+
+
+def list_indexes_sql():
+    tables = ", ".join(f"'{vector_space.table}'" for vector_space in VECTOR_SPACES.values())
+    return f"""
+    SELECT tablename, indexname, indexdef
+    FROM pg_indexes
+    WHERE schemaname = 'public' AND tablename IN ({tables})
+      AND (indexdef ILIKE '% USING hnsw %' OR indexdef ILIKE '% USING ivfflat %')
+    ORDER BY tablename, indexname
+    """
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage pgvector ANN indexes on embedding columns")
+    parser.add_argument("action", choices=("create", "drop", "list"))
+    parser.add_argument("--space", action="append", choices=sorted(VECTOR_SPACES), help="Default: all spaces")
+    parser.add_argument("--method", choices=INDEX_METHODS, default="hnsw")
+    parser.add_argument("--metric", choices=sorted(METRICS), default="cosine")
+    parser.add_argument("--m", type=int, default=16, help="HNSW: links per node")
+    parser.add_argument("--ef-construction", type=int, default=64, help="HNSW: build-time candidate list size")
+    parser.add_argument("--lists", type=int, default=100, help="IVFFlat: number of lists (about rows / 1000)")
+    args = parser.parse_args(argv)
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from libraries.db.db import DB
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = DB(
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        database=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        max_connections=1
+    )
+    try:
+        if args.action == "list":
+            for row in db.query(list_indexes_sql()) or []:
+                print(*row, sep="\t")
+            return
+        for space in args.space or sorted(VECTOR_SPACES):
+            try:
+                if args.action == "create":
+                    logging.info(f"Creating {args.method}/{args.metric} index on {space}")
+                    db.query(create_index_sql(space, args.method, args.metric, args.m, args.ef_construction, args.lists))
+                else:
+                    logging.info(f"Dropping {args.method}/{args.metric} index on {space}")
+                    db.query(drop_index_sql(space, args.method, args.metric))
+            except Exception as e:
+                # e.g. known_class_detections.embedding is declared without dimensions, which ANN indexes need
+                logging.error(f"Error updating index on {space}: {e}")
+    finally:
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
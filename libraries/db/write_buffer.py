@@ -0,0 +1,108 @@
+import atexit
+import logging
+import threading
+import time
+from psycopg2.extras import execute_values
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for high-rate inserts (gps, sensor, key and motion events).
+
+    Rows are grouped per table and written with one multi-row INSERT per table and one
+    commit per flush. A flush happens once any table holds max_rows rows or flush_interval
+    seconds after the previous flush, whichever comes first. When max_buffered_rows rows
+    are waiting, add() blocks until the next flush frees space (backpressure).
+    """
+
+    def __init__(self, db, max_rows=500, flush_interval=0.25, max_buffered_rows=10000):
+        self.db = db
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self._batches = {}
+        self._buffered_rows = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._flush_loop, name="db-write-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, table, columns, row, timeout=None):
+        """
+        Queue one row for insertion into table (columns is a tuple of column names).
+
+        Returns False if the buffer is closed or stayed full for longer than timeout seconds.
+        """
+        key = (table, tuple(columns))
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._closed or self._buffered_rows < self.max_buffered_rows, timeout=timeout
+            ) or self._closed:
+                self.rows_dropped += 1
+                logging.warning(f"Write buffer full or closed, dropping row for {table}")
+                return False
+            rows = self._batches.setdefault(key, [])
+            rows.append(row)
+            self._buffered_rows += 1
+            if len(rows) >= self.max_rows:
+                self._condition.notify_all()
+        return True
+
+    def _batch_ready(self):
+        return self._closed or any(len(rows) >= self.max_rows for rows in self._batches.values())
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._batch_ready, timeout=self.flush_interval)
+                batches = self._batches
+                self._batches = {}
+                closing = self._closed
+            try:
+                self._write(batches)
+            finally:
+                # Written or dropped, these rows no longer hold buffer space; if this is skipped
+                # add() blocks forever
+                with self._condition:
+                    self._buffered_rows -= sum(len(rows) for rows in batches.values())
+                    self._condition.notify_all()
+            if closing:
+                with self._condition:
+                    if not self._batches:
+                        return
+
+    def _write(self, batches):
+        for (table, columns), rows in batches.items():
+            query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+            try:
+                self.db.run(lambda cursor: execute_values(cursor, query, rows, page_size=self.max_rows))
+                self.rows_written += len(rows)
+            except Exception as e:
+                # Only this table's batch is lost; the other tables were written in their own
+                # transactions. Anything, not just psycopg2.Error (pool timeouts, adaptation
+                # errors), must not kill the flush thread.
+                self.rows_dropped += len(rows)
+                logging.error(f"Error flushing {len(rows)} buffered rows into {table}: {e}")
+
+    def flush(self, timeout=None):
+        """Block until everything buffered before this call has been written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._buffered_rows > 0 and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining if remaining is not None else self.flush_interval)
+        return True
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
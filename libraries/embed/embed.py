@@ -1,26 +1,27 @@
-from fastembed import TextEmbedding, ImageEmbedding
 from typing import List
 import numpy as np
-from transformers import ClapModel, ClapProcessor
 import librosa
+from libraries.embed.models import get_registry
 
 class EmbeddingService:
-    def __init__(self):
-        self.text_model = TextEmbedding(model_name="Qdrant/clip-ViT-B-32-text")
-        self.image_model = ImageEmbedding(model_name="Qdrant/clip-ViT-B-32-vision")
-        self.clap_model = ClapModel.from_pretrained("laion/clap-htsat-unfused")
-        self.clap_processor = ClapProcessor.from_pretrained("laion/clap-htsat-unfused")
+    # Models come from the process-wide registry, so every EmbeddingService (and the audio
+    # processor) shares one copy of each, loaded on first use
+    def __init__(self, registry=None):
+        self.models = registry or get_registry()
 
     def embed_text(self, texts: List[str]):
-        embeddings = self.text_model.embed(texts)
-        return [embedding.tolist() for embedding in embeddings]
+        with self.models.use("clip_text") as text_model:
+            embeddings = text_model.embed(texts)
+            return [embedding.tolist() for embedding in embeddings]
 
     def embed_image(self, image_path: str):
-        embeddings = self.image_model.embed([image_path])
-        return [embedding.tolist() for embedding in embeddings]
+        with self.models.use("clip_vision") as image_model:
+            embeddings = image_model.embed([image_path])
+            return [embedding.tolist() for embedding in embeddings]
 
     def embed_audio(self, audio_path: str):
         audio_data, sr = librosa.load(audio_path, sr=48000)
-        inputs = self.clap_processor(audios=audio_data, return_tensors="pt", sampling_rate=sr)
-        audio_embed = self.clap_model.get_audio_features(**inputs)
-        return audio_embed.detach().numpy().tolist()
+        with self.models.use("clap") as (clap_model, clap_processor):
+            inputs = clap_processor(audios=audio_data, return_tensors="pt", sampling_rate=sr)
+            audio_embed = clap_model.get_audio_features(**inputs)
+            return audio_embed.detach().numpy().tolist()
@@ -0,0 +1,164 @@
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CLAP_MODEL = "laion/clap-htsat-unfused"
+CLIP_TEXT_MODEL = "Qdrant/clip-ViT-B-32-text"
+CLIP_VISION_MODEL = "Qdrant/clip-ViT-B-32-vision"
+
+
+def load_clap():
+    from transformers import ClapModel, ClapProcessor
+    return ClapModel.from_pretrained(CLAP_MODEL), ClapProcessor.from_pretrained(CLAP_MODEL)
+
+
+def load_clip_text():
+    from fastembed import TextEmbedding
+    return TextEmbedding(model_name=CLIP_TEXT_MODEL)
+
+
+def load_clip_vision():
+    from fastembed import ImageEmbedding
+    return ImageEmbedding(model_name=CLIP_VISION_MODEL)
+
+
+class _Entry:
+    def __init__(self, loader):
+        self.loader = loader
+        self.model = None
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+
+
+class ModelRegistry:
+    """
+    Process-wide models, each loaded once on first use and shared by every caller.
+
+    Use a model inside `with registry.use(name) as model:` so it isn't unloaded mid-call. With
+    idle_unload_seconds set, a background thread drops models nobody has used for that long;
+    the next use loads them again. warmup() loads models ahead of their first use.
+    """
+
+    def __init__(self, idle_unload_seconds=None):
+        self.idle_unload_seconds = idle_unload_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def register(self, name, loader):
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = _Entry(loader)
+
+    def _entry(self, name):
+        if name not in self._entries:
+            raise KeyError(f"Unknown model {name!r}, expected one of {sorted(self._entries)}")
+        return self._entries[name]
+
+    def _load(self, name, entry):
+        # Callers hold entry.lock, so concurrent first uses wait for one load
+        if entry.model is None:
+            started = time.monotonic()
+            entry.model = entry.loader()
+            entry.loads += 1
+            logger.info(f"Loaded model {name} in {time.monotonic() - started:.1f}s")
+        return entry.model
+
+    @contextmanager
+    def use(self, name):
+        entry = self._entry(name)
+        with entry.lock:
+            model = self._load(name, entry)
+            entry.in_use += 1
+        try:
+            yield model
+        finally:
+            with entry.lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def get(self, name):
+        """The loaded model, without pinning it; prefer use() where idle unloading is on."""
+        entry = self._entry(name)
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            return self._load(name, entry)
+
+    def warmup(self, names=None, background=False):
+        names = list(names or self._entries)
+        if background:
+            threading.Thread(target=self.warmup, args=(names,), name="model-warmup", daemon=True).start()
+            return
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Error warming up model {name}: {e}")
+
+    def unload(self, name):
+        entry = self._entry(name)
+        with entry.lock:
+            if entry.model is None or entry.in_use:
+                return False
+            entry.model = None
+        gc.collect()
+        # Only touch torch if something already imported it
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info(f"Unloaded model {name}")
+        return True
+
+    def unload_idle(self):
+        now = time.monotonic()
+        for name, entry in list(self._entries.items()):
+            if entry.model is not None and not entry.in_use and now - entry.last_used >= self.idle_unload_seconds:
+                self.unload(name)
+
+    def start_idle_unloader(self):
+        if self.idle_unload_seconds and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name="model-idle-unload", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_unload_seconds / 4, 1))
+            self.unload_idle()
+
+    def stats(self):
+        return {
+            name: {"loaded": entry.model is not None, "in_use": entry.in_use, "loads": entry.loads}
+            for name, entry in self._entries.items()
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    The process's model registry with CLAP and CLIP registered. MODEL_IDLE_UNLOAD_SECONDS
+    (0 = never) sets the idle-unload policy; MODEL_WARMUP lists models to load up front
+    on a background thread.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(idle_unload_seconds=float(os.getenv("MODEL_IDLE_UNLOAD_SECONDS", 0)) or None)
+            _registry.register("clap", load_clap)
+            _registry.register("clip_text", load_clip_text)
+            _registry.register("clip_vision", load_clip_vision)
+            _registry.start_idle_unloader()
+            warmup = [name.strip() for name in os.getenv("MODEL_WARMUP", "").split(",") if name.strip()]
+            if warmup:
+                _registry.warmup(warmup, background=True)
+        return _registry
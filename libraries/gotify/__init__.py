@@ -1 +1 @@
-from .gotify import send_gotify_message
+from .gotify import send_gotify_message, get_rate_state
@@ -1,19 +1,22 @@
 import os
 import requests
 import json
+import threading
 
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from libraries.db.db import DB
+from libraries.gotify.rate_state import NotificationRateState
 
 GOTIFY_URL = os.getenv("GOTIFY_URL")
 GOTIFY_AUTH_TOKEN = os.getenv("GOTIFY_AUTH_TOKEN")
 
 # Extras can open url on notification click
 # https://gotify.net/docs/msgextras
-def send_gotify_message(title, message, priority=10, extras=None):
+# known_class is recorded with the message so rate limits can be kept per class
+def send_gotify_message(title, message, priority=10, extras=None, known_class=None):
     url = f"{GOTIFY_URL}/message?token={GOTIFY_AUTH_TOKEN}"
     
     # if extras and "client::notification" in extras and "click" in extras["client::notification"]:
@@ -38,41 +41,61 @@ def send_gotify_message(title, message, priority=10, extras=None):
         print(f"Error sending Gotify message: {e}")
         return None
     
-    log_gotify_message(title, message, priority, response.status_code, extras)
+    # Logged first so the rate state knows the row id and won't count it again when other
+    # processes' sends are read back from the log
+    log_id = log_gotify_message(title, message, priority, response.status_code, extras, known_class)
+    get_rate_state().record_sent(title, known_class=known_class, log_id=log_id)
     
     return response
 
-def log_gotify_message(title, message, priority, status_code, extras):
-    conn = None
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    # One pooled DB per process instead of a fresh connection for every message
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = DB(
+                host=os.getenv("POSTGRES_HOST"),
+                port=os.getenv("POSTGRES_PORT"),
+                database=os.getenv("POSTGRES_DB"),
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                max_connections=2
+            )
+        return _db
+
+_rate_state = None
+_rate_state_lock = threading.Lock()
+
+def get_rate_state():
+    # Last-sent times shared by everything in this process that sends or throttles notifications
+    global _rate_state
+    with _rate_state_lock:
+        if _rate_state is None:
+            _rate_state = NotificationRateState(get_db())
+        return _rate_state
+
+def log_gotify_message(title, message, priority, status_code, extras, known_class=None):
     try:
-        db = DB(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            database=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
-        conn = db.connection
-        cursor = conn.cursor()
         insert_query = """
         INSERT INTO public.gotify_message_log (message, sent_at, parameters, device_id)
         VALUES (%s, CURRENT_TIMESTAMP AT TIME ZONE 'UTC', %s, NULL)
+        RETURNING id
         """
         parameters = {
             'title': title,
             'message': message,
             'priority': priority,
             'status_code': status_code,
-            'extras': extras
+            'extras': extras,
+            'known_class': known_class
         }
-        cursor.execute(insert_query, (message, json.dumps(parameters)))
-        conn.commit()
-        cursor.close()
+        return get_db().query(insert_query, (message, json.dumps(parameters)))[0][0]
     except Exception as e:
         print(f"Error logging gotify message: {e}")
-    finally:
-        if conn:
-            conn.close()
+        return None
 
 # Example usage
 if __name__ == "__main__":
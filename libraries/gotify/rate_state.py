@@ -0,0 +1,170 @@
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+DEFAULT_CHANNEL = "gotify"
+
+# Latest send per title/known class, plus the highest log id so later refreshes only read new rows
+SELECT_LAST_SENT = """
+SELECT parameters->>'title', parameters->>'known_class', MAX(sent_at AT TIME ZONE 'UTC'), MAX(id)
+FROM public.gotify_message_log
+WHERE id > %s
+GROUP BY 1, 2
+"""
+
+SELECT_RECENT_SENDS = """
+SELECT id, parameters->>'title', parameters->>'known_class', sent_at AT TIME ZONE 'UTC'
+FROM public.gotify_message_log
+WHERE sent_at > (NOW() AT TIME ZONE 'UTC') - %s * INTERVAL '1 second'
+ORDER BY sent_at
+"""
+
+# Every send logged since the last refresh, by any process
+SELECT_SENDS_AFTER = """
+SELECT id, parameters->>'title', parameters->>'known_class', sent_at AT TIME ZONE 'UTC'
+FROM public.gotify_message_log
+WHERE id > %s
+ORDER BY id
+"""
+
+
+def _naive_utc(sent_at):
+    # AT TIME ZONE 'UTC' gives naive UTC for a timestamptz column but an aware value for timestamp
+    if sent_at is not None and sent_at.tzinfo is not None:
+        return sent_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return sent_at
+
+
+class NotificationRateState:
+    """
+    In-memory view of when notifications were last sent, per title, known class and channel.
+
+    Seeded from gotify_message_log once, updated by record_sent() on every send in this
+    process, and caught up with other processes' sends (last-sent times and the recent sends
+    count_since() reads) every refresh_interval seconds on a background thread, so counts
+    cover every process, up to refresh_interval behind. Sends are matched to their log row
+    id so one is never counted twice. Reads never touch the database. All times are naive
+    UTC datetimes, like the rest of the gotify_message_log readers.
+    """
+
+    def __init__(self, db, refresh_interval=60, history_seconds=3600):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.history_seconds = history_seconds
+        self._last_sent = {}
+        self._recent = defaultdict(deque)
+        # Log ids already in _recent -> their sent_at, so a send is counted once
+        self._counted_log_ids = {}
+        self._last_log_id = 0
+        self._lock = threading.Lock()
+        self._seeded = False
+        self._seed_lock = threading.Lock()
+
+    @staticmethod
+    def _keys(title, known_class, channel):
+        keys = [("channel", channel)]
+        if title:
+            keys.append(("title", channel, title))
+        if known_class:
+            keys.append(("class", channel, known_class))
+        return keys
+
+    @staticmethod
+    def _key(title, known_class, channel):
+        if known_class:
+            return ("class", channel, known_class)
+        if title:
+            return ("title", channel, title)
+        return ("channel", channel)
+
+    def _merge_last_sent(self, title, known_class, channel, sent_at):
+        for key in self._keys(title, known_class, channel):
+            if key not in self._last_sent or self._last_sent[key] < sent_at:
+                self._last_sent[key] = sent_at
+
+    def _add_recent(self, title, known_class, channel, sent_at, log_id=None):
+        # Caller holds self._lock
+        if log_id is not None:
+            if log_id in self._counted_log_ids:
+                return
+            self._counted_log_ids[log_id] = sent_at
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.history_seconds)
+        for key in self._keys(title, known_class, channel):
+            recent = self._recent[key]
+            recent.append(sent_at)
+            while recent and recent[0] < cutoff:
+                recent.popleft()
+
+    def _forget_old_log_ids(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.history_seconds)
+        with self._lock:
+            for log_id in [log_id for log_id, sent_at in self._counted_log_ids.items() if sent_at < cutoff]:
+                del self._counted_log_ids[log_id]
+
+    def seed(self):
+        """Load last-sent times and recent sends from the log. Only the first call queries."""
+        with self._seed_lock:
+            if self._seeded:
+                return
+            self._seeded = True
+            try:
+                rows = self.db.sync_query(SELECT_LAST_SENT, (self._last_log_id,)) or []
+                recent = self.db.sync_query(SELECT_RECENT_SENDS, (self.history_seconds,)) or []
+                with self._lock:
+                    for title, known_class, sent_at, log_id in rows:
+                        self._merge_last_sent(title, known_class, DEFAULT_CHANNEL, _naive_utc(sent_at))
+                        self._last_log_id = max(self._last_log_id, log_id)
+                    for log_id, title, known_class, sent_at in recent:
+                        self._add_recent(title, known_class, DEFAULT_CHANNEL, _naive_utc(sent_at), log_id)
+            except Exception as e:
+                logging.error(f"Error seeding notification rate state: {e}")
+            if self.refresh_interval:
+                threading.Thread(target=self._refresh_loop, name="notification-rate-state", daemon=True).start()
+
+    def _catch_up(self):
+        rows = self.db.sync_query(SELECT_SENDS_AFTER, (self._last_log_id,))
+        if not rows:
+            return
+        with self._lock:
+            for log_id, title, known_class, sent_at in rows:
+                sent_at = _naive_utc(sent_at)
+                self._merge_last_sent(title, known_class, DEFAULT_CHANNEL, sent_at)
+                self._add_recent(title, known_class, DEFAULT_CHANNEL, sent_at, log_id)
+                self._last_log_id = max(self._last_log_id, log_id)
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._catch_up()
+                self._forget_old_log_ids()
+            except Exception as e:
+                logging.error(f"Error refreshing notification rate state: {e}")
+
+    def record_sent(self, title, known_class=None, channel=DEFAULT_CHANNEL, sent_at=None, log_id=None):
+        """Record a send from this process; log_id is its gotify_message_log row, if it was logged."""
+        sent_at = sent_at or datetime.datetime.utcnow()
+        with self._lock:
+            self._merge_last_sent(title, known_class, channel, sent_at)
+            self._add_recent(title, known_class, channel, sent_at, log_id)
+
+    def last_sent(self, title=None, known_class=None, channel=DEFAULT_CHANNEL):
+        """Last send for a known class, else a title, else anything on the channel; None if never."""
+        self.seed()
+        with self._lock:
+            return self._last_sent.get(self._key(title, known_class, channel))
+
+    def seconds_since_last_sent(self, title=None, known_class=None, channel=DEFAULT_CHANNEL):
+        last_sent = self.last_sent(title, known_class, channel)
+        if last_sent is None:
+            return None
+        return (datetime.datetime.utcnow() - last_sent).total_seconds()
+
+    def count_since(self, seconds, title=None, known_class=None, channel=DEFAULT_CHANNEL):
+        """Sends in the last `seconds` (at most history_seconds) for a known class, title or channel."""
+        self.seed()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+        with self._lock:
+            return sum(1 for sent_at in self._recent.get(self._key(title, known_class, channel), ()) if sent_at > cutoff)
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark for the realtime audio resampling path.
+
+Compares the old per-sample nearest-neighbour upsampler (8 kHz -> 16 kHz for whisper) and
+librosa.resample (8 kHz -> 48 kHz for CLAP) against processors.resample, plus
+scipy.signal.resample_poly with the same taps for the CLAP window.
+
+Run from the realtime directory:
+    python -m benchmarks.resample_benchmark
+"""
+import timeit
+import numpy as np
+from scipy.signal import resample_poly
+from processors.resample import StreamingResampler, resample, design_filter, pcm16_to_float32, float32_to_pcm16
+
+SAMPLE_RATE = 8000
+CHUNK_SAMPLES = 1600   # 200 ms, a typical websocket audio frame
+WINDOW_SECONDS = 5     # classification window
+REPEAT = 5
+
+
+def upsample_buffer_loop(buffer, sample_rate, out_sample_rate):
+    # Previous AudioSession.upsample_buffer
+    ratio = out_sample_rate / sample_rate
+    new_length = int(len(buffer) * ratio)
+    result = np.zeros(new_length, dtype=np.int16)
+    for i in range(new_length):
+        result[i] = buffer[int(i / ratio)]
+    return result
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=REPEAT)) / number
+
+
+def report(name, before, after):
+    print(f"{name:<28} before {before * 1e6:10.1f} us   after {after * 1e6:10.1f} us   speedup {before / after:6.1f}x")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    chunk = (rng.standard_normal(CHUNK_SAMPLES) * 3000).astype("<i2").tobytes()
+    window = rng.standard_normal(WINDOW_SECONDS * SAMPLE_RATE).astype(np.float32) * 0.1
+
+    streaming = StreamingResampler(SAMPLE_RATE, 16000)
+    report(
+        "chunk 8k -> 16k (whisper)",
+        best_of(lambda: upsample_buffer_loop(np.frombuffer(chunk, dtype=np.int16), SAMPLE_RATE, 16000).tobytes(), 20),
+        best_of(lambda: float32_to_pcm16(streaming.process(pcm16_to_float32(chunk))).tobytes(), 200),
+    )
+
+    try:
+        import librosa
+        before = best_of(lambda: librosa.resample(window, orig_sr=SAMPLE_RATE, target_sr=48000), 5)
+    except ImportError:
+        before = None
+    after = best_of(lambda: resample(window, SAMPLE_RATE, 48000), 20)
+    if before is None:
+        print(f"{'window 8k -> 48k (CLAP)':<28} librosa not installed   after {after * 1e6:10.1f} us")
+    else:
+        report("window 8k -> 48k (CLAP)", before, after)
+    taps = design_filter(6, 1)
+    report("window 8k -> 48k (poly)", best_of(lambda: resample_poly(window, 6, 1, window=taps), 20), after)
+
+
+if __name__ == "__main__":
+    main()
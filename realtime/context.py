@@ -4,20 +4,13 @@ from fastapi.templating import Jinja2Templates
 from datetime import datetime, timedelta, timezone
 import logging
 import os
-from libraries.db.db import DB
+from libraries.gotify.gotify import get_rate_state
 
 templates = Jinja2Templates(directory="templates")
 logger = logging.getLogger(__name__)
 
-db = DB(
-    host=os.getenv("POSTGRES_HOST"),
-    port=os.getenv("POSTGRES_PORT"),
-    database=os.getenv("POSTGRES_DB"),
-    user=os.getenv("POSTGRES_USER"),
-    password=os.getenv("POSTGRES_PASSWORD")
-)
-
-async def get_current_context_logic(request: Request, json_only: bool = False, hours_ago: int = 24):
+async def get_current_context_logic(db, request: Request, json_only: bool = False, hours_ago: int = 24):
+    # db is the realtime service's AsyncDB
     try:
         query = """
         SELECT 
@@ -105,7 +98,7 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         LEFT JOIN known_locations kl ON kl.id = d.last_known_location_id
         WHERE d.id = 1
         """
-        result = db.sync_query(query)
+        result = await db.query(query)
         
         if not result or len(result) == 0:
             raise HTTPException(status_code=404, detail="No data found")
@@ -148,7 +141,7 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
                 created_at,
                 LAG(created_at) OVER (ORDER BY created_at) AS prev_created_at
             FROM speech_data
-            WHERE created_at > NOW() - INTERVAL %s
+            WHERE created_at > NOW() - $1::interval
         ),
         merged_speech AS (
             SELECT 
@@ -176,7 +169,7 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         ocr_query = """
         SELECT ocr_result, created_at
         FROM image_data
-        WHERE created_at > NOW() - INTERVAL %s
+        WHERE created_at > NOW() - $1::interval
         AND ocr_result IS NOT NULL
         ORDER BY created_at DESC;
         """
@@ -187,14 +180,14 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
             dsl.timestamp
         FROM device_status_log dsl
         JOIN known_locations kl ON ST_Contains(kl.gps_polygon, ST_SetSRID(ST_Point(ST_X(dsl.location::geometry), ST_Y(dsl.location::geometry)), 4326))
-        WHERE dsl.timestamp > NOW() - INTERVAL %s
+        WHERE dsl.timestamp > NOW() - $1::interval
         ORDER BY dsl.device_id, dsl.timestamp DESC;
         """
         known_class_query = """
         SELECT kc.name, kcd.created_at
         FROM known_class_detections kcd
         JOIN known_classes kc ON kcd.known_class_id = kc.id
-        WHERE kcd.created_at > NOW() - INTERVAL %s
+        WHERE kcd.created_at > NOW() - $1::interval
         ORDER BY kcd.created_at DESC;
         """
         all_known_classes_query = """
@@ -210,35 +203,35 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         llm_actions_query = """
         SELECT id, created_at, metadata, success
         FROM public.llm_actions
-        WHERE created_at > NOW() - INTERVAL %s
+        WHERE created_at > NOW() - $1::interval
         ORDER BY created_at DESC;
         """
 
         llm_memories_query = """
         SELECT id, created_at, content, metadata
         FROM public.llm_memories
-        WHERE created_at > NOW() - INTERVAL %s
+        WHERE created_at > NOW() - $1::interval
         ORDER BY created_at DESC;
         """
 
         tweets_query = """
         SELECT id, "timestamp", tweet_text as text
         FROM public.tweets
-        WHERE "timestamp" > NOW() - INTERVAL %s
+        WHERE "timestamp" > NOW() - $1::interval
         ORDER BY "timestamp" DESC;
         """
 
         github_repos_query = """
         SELECT repo_id, created_at, repo_name
         FROM public.github_stars
-        WHERE created_at > NOW() - INTERVAL %s
+        WHERE created_at > NOW() - $1::interval
         ORDER BY created_at DESC;
         """
 
         contacts_query = """
         SELECT id, created_at, full_name as name, email, phone
         FROM public.contacts
-        WHERE created_at > NOW() - INTERVAL %s
+        WHERE created_at > NOW() - $1::interval
         ORDER BY created_at DESC;
         """
 
@@ -249,17 +242,17 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         """
         
         # Execute new queries
-        speech_data = db.sync_query(speech_query, (time_range,)) if speech_query else None
-        ocr_data = db.sync_query(ocr_query, (time_range,)) if ocr_query else None
-        location_data = db.sync_query(location_query, (time_range,)) if location_query else None
-        known_class_data = db.sync_query(known_class_query, (time_range,)) if known_class_query else None
-        all_known_classes_data = db.sync_query(all_known_classes_query) if all_known_classes_query else None
-        llm_actions_data = db.sync_query(llm_actions_query, (time_range,)) if llm_actions_query else None
-        llm_memories_data = db.sync_query(llm_memories_query, (time_range,)) if llm_memories_query else None
-        tweets_data = db.sync_query(tweets_query, (time_range,)) if tweets_query else None
-        github_repos_data = db.sync_query(github_repos_query, (time_range,)) if github_repos_query else None
-        contacts_data = db.sync_query(contacts_query, (time_range,)) if contacts_query else None
-        documents_data = db.sync_query(documents_query) if documents_query else None
+        speech_data = await db.query(speech_query, time_range) if speech_query else None
+        ocr_data = await db.query(ocr_query, time_range) if ocr_query else None
+        location_data = await db.query(location_query, time_range) if location_query else None
+        known_class_data = await db.query(known_class_query, time_range) if known_class_query else None
+        all_known_classes_data = await db.query(all_known_classes_query) if all_known_classes_query else None
+        llm_actions_data = await db.query(llm_actions_query, time_range) if llm_actions_query else None
+        llm_memories_data = await db.query(llm_memories_query, time_range) if llm_memories_query else None
+        tweets_data = await db.query(tweets_query, time_range) if tweets_query else None
+        github_repos_data = await db.query(github_repos_query, time_range) if github_repos_query else None
+        contacts_data = await db.query(contacts_query, time_range) if contacts_query else None
+        documents_data = await db.query(documents_query) if documents_query else None
 
         # Merge timeline data
         timeline_data = []
@@ -282,15 +275,15 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         if tweets_data:
             for row in tweets_data:
                 if row and len(row) >= 3:
-                    timeline_data.append({'type': 'tweet', 'id': row[0], 'text': row[2], 'timestamp': row[1]})
+                    timeline_data.append({'type': 'tweet', 'id': str(row[0]) if row[0] is not None else None, 'text': row[2], 'timestamp': row[1]})
         if github_repos_data:
             for row in github_repos_data:
                 if row and len(row) >= 3:
-                    timeline_data.append({'type': 'github_repo', 'id': row[0], 'full_name': row[2], 'timestamp': row[1]})
+                    timeline_data.append({'type': 'github_repo', 'id': str(row[0]) if row[0] is not None else None, 'full_name': row[2], 'timestamp': row[1]})
         if contacts_data:
             for row in contacts_data:
                 if row and len(row) >= 5:
-                    timeline_data.append({'type': 'contact', 'id': row[0], 'name': row[2], 'email': row[3], 'phone': row[4], 'timestamp': row[1]})
+                    timeline_data.append({'type': 'contact', 'id': str(row[0]) if row[0] is not None else None, 'name': row[2], 'email': row[3], 'phone': row[4], 'timestamp': row[1]})
         
         # Sort timeline data by timestamp
         if timeline_data:
@@ -308,7 +301,7 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
         context['last_time_llm_was_called_relative'] = f"{minutes} minutes ago"
 
         try:
-            last_used_app_row = db.sync_query(
+            last_used_app_row = await db.query(
                 """
                 SELECT package_name, last_time_visible 
                 FROM public.app_usage_stats 
@@ -326,7 +319,7 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
                 context['last_used_app'] = None
 
             # Calculate the foreground usage time for every app and add that to context
-            app_usage_rows = db.sync_query(
+            app_usage_rows = await db.query(
                 """
                 SELECT package_name, SUM(total_time_in_foreground) as total_foreground_time
                 FROM public.app_usage_stats
@@ -354,16 +347,10 @@ async def get_current_context_logic(request: Request, json_only: bool = False, h
 
         last_sent_notification_hours_ago = None
         try:
-            last_sent_at_row = db.sync_query(
-                """
-                SELECT sent_at AT TIME ZONE 'UTC' FROM gotify_message_log 
-                ORDER BY sent_at DESC 
-                LIMIT 1
-                """
-            )
+            # Same in-memory view the audio processor throttles on
+            last_sent_at = get_rate_state().last_sent()
 
-            if last_sent_at_row:
-                last_sent_at = last_sent_at_row[0][0]
+            if last_sent_at:
                 time_since_last_sent = datetime.utcnow() - last_sent_at
                 logger.info(f"context - Time since last sent: {time_since_last_sent}")
                 last_sent_notification_hours_ago = time_since_last_sent.total_seconds() / 3600
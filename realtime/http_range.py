@@ -0,0 +1,65 @@
+import os
+import re
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+RANGE_HEADER = re.compile(r"bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(range_header, size):
+    """Single byte range from a Range header as (start, end) inclusive; None for the whole body."""
+    if not range_header:
+        return None
+    match = RANGE_HEADER.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        # Multiple or malformed ranges: serve the whole body, which RFC 9110 allows
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _file_chunks(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def range_file_response(path, media_type, range_header=None):
+    """Stream a file, honouring a single-range Range header with 206 Partial Content."""
+    size = os.path.getsize(path)
+    byte_range = parse_range(range_header, size)
+    headers = {"Accept-Ranges": "bytes"}
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_file_chunks(path, 0, size), media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_file_chunks(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
+
+
+def range_bytes_response(data, media_type, range_header=None):
+    """Same as range_file_response for data already in memory (clips stored in the row)."""
+    byte_range = parse_range(range_header, len(data))
+    headers = {"Accept-Ranges": "bytes"}
+    if byte_range is None:
+        return Response(content=bytes(data), media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(content=bytes(data[start:end + 1]), status_code=206, media_type=media_type, headers=headers)
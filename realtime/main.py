@@ -28,7 +28,12 @@ from datetime import datetime, timedelta
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from libraries.db.db import DB
+from libraries.db.async_db import AsyncDB
+from libraries.db.local_index import LocalVectorIndex
 from realtime.context import get_current_context_logic  # Import the function
+from realtime.protocol import decode_frame
+from realtime.http_range import range_file_response, range_bytes_response
+from processors.process_audio import DETECTION_CLIP_MEDIA_TYPES
 
 app = FastAPI()
 
@@ -54,9 +59,45 @@ db = DB(
     password=os.getenv("POSTGRES_PASSWORD")
 )
 
+# Used by the async handlers so queries don't block the event loop
+async_db = AsyncDB(
+    host=os.getenv("POSTGRES_HOST"),
+    port=os.getenv("POSTGRES_PORT"),
+    database=os.getenv("POSTGRES_DB"),
+    user=os.getenv("POSTGRES_USER"),
+    password=os.getenv("POSTGRES_PASSWORD")
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# In-process ANN mirror of the embedding columns for similarity lookups that skip Postgres
+local_vector_index = None
+if os.getenv("LOCAL_VECTOR_INDEX_DIR"):
+    local_vector_index = LocalVectorIndex(
+        os.getenv("LOCAL_VECTOR_INDEX_DIR"),
+        db,
+        spaces=[space for space in os.getenv("LOCAL_VECTOR_INDEX_SPACES", "").split(",") if space] or None,
+        refresh_interval=float(os.getenv("LOCAL_VECTOR_INDEX_REFRESH_SECONDS", "30"))
+    )
+
+@app.on_event("startup")
+async def startup_db():
+    await async_db.connect()
+    audio_processor.start()
+    if local_vector_index is not None:
+        local_vector_index.start()
+
+@app.on_event("shutdown")
+async def shutdown_db():
+    # Finalize open audio archive files before the process exits
+    audio_processor.close()
+    if local_vector_index is not None:
+        local_vector_index.close()
+    await async_db.close()
+    # Flush buffered telemetry rows before the pool goes away
+    db.close_connection()
+
 class EmbedRequest(BaseModel):
     texts: List[str] = None
     image_paths: List[str] = None
@@ -91,7 +132,7 @@ class MotionEventData(BaseModel):
 class NotificationData(BaseModel):
     data: str
 
-audio_processor = AudioProcessor(db)
+audio_processor = AudioProcessor(db, async_db)
 image_processor = ImageProcessor(db)
 embedding_service = EmbeddingService()
 
@@ -111,14 +152,21 @@ async def websocket_endpoint(websocket: WebSocket):
     client_user_agent = websocket.headers.get('user-agent', 'unknown')
     connection_time = datetime.now()
     
-    db.insert_websocket_metadata(connection_time, None, client_ip, client_user_agent, "connected")
+    await async_db.insert_websocket_metadata(connection_time, None, client_ip, client_user_agent, "connected")
     
     await websocket.accept()
     try:
         while True:
-            data = await websocket.receive_text()
-            # print(data[:100])
-            messages = json.loads(data)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+
+            if frame.get("bytes") is not None:
+                # Binary audio/image frame: header + raw zstd payload, no JSON or base64
+                messages = decode_frame(frame["bytes"])
+            else:
+                # print(frame["text"][:100])
+                messages = json.loads(frame["text"])
                 
             if not isinstance(messages, list):
                 messages = [messages]
@@ -140,10 +188,11 @@ async def websocket_endpoint(websocket: WebSocket):
                     await audio_processor.handle_audio_message(message, websocket, device_id)
                 elif message_type == "gps":
                     gps_model = GpsData(**message.get("data"))
-                    db.insert_gps_data(gps_model.latitude, gps_model.longitude, gps_model.altitude, gps_model.time, device_id)
+                    # timeout=0: a full write buffer drops (and counts) the row instead of blocking the event loop
+                    db.insert_gps_data(gps_model.latitude, gps_model.longitude, gps_model.altitude, gps_model.time, device_id, timeout=0)
                 elif message_type == "sensor":
                     sensor_data = SensorData(**message.get("data"))
-                    db.insert_sensor_data(sensor_data.sensorType, sensor_data.x, sensor_data.y, sensor_data.z, device_id)
+                    db.insert_sensor_data(sensor_data.sensorType, sensor_data.x, sensor_data.y, sensor_data.z, device_id, timeout=0)
                 elif message_type == "app_usage":
                     app_usage_data = message.get("data", [])
                     for app_usage in app_usage_data:
@@ -157,7 +206,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         total_time_visible = app_usage.get("totalTimeVisible")
                         total_time_foreground_service_used = app_usage.get("totalTimeForegroundServiceUsed")
                         
-                        db.insert_app_usage_stats(
+                        await async_db.insert_app_usage_stats(
                             package_name,
                             total_time_in_foreground,
                             first_timestamp,
@@ -197,20 +246,20 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         logger.info("Client disconnected")
         disconnection_time = datetime.now()
-        db.insert_websocket_metadata(connection_time, disconnection_time, client_ip, client_user_agent, "disconnected")
+        await async_db.insert_websocket_metadata(connection_time, disconnection_time, client_ip, client_user_agent, "disconnected")
         
     except Exception as e:
         logger.error(f"Error: {str(e)}", exc_info=True)  # Add exc_info=True to log the traceback
         await websocket.send_json({"status": "error", "detail": str(e)})
         disconnection_time = datetime.now()
-        db.insert_websocket_metadata(connection_time, disconnection_time, client_ip, client_user_agent, "error")
+        await async_db.insert_websocket_metadata(connection_time, disconnection_time, client_ip, client_user_agent, "error")
 
 @app.get("/heartbeat")
 async def heartbeat():
     # return JSONResponse(status_code=200, content={"status": "online"})
     try:
         # Check database connection
-        db.execute_query("SELECT 1")
+        await async_db.fetchval("SELECT 1")
 
         # Check disk space
         _, _, free = shutil.disk_usage("/")
@@ -225,28 +274,58 @@ async def heartbeat():
 
 @app.get("/context")
 async def get_current_context(request: Request, json_only: bool = False, hours_ago: int = 24):
-    return await get_current_context_logic(request, json_only, hours_ago)
+    return await get_current_context_logic(async_db, request, json_only, hours_ago)
+
+@app.get("/detection-audio/{known_class_detection_id}")
+async def detection_audio(request: Request, known_class_detection_id: str):
+    # Streams the clip as audio/*; Range requests let the player seek without downloading it all
+    try:
+        detection = await async_db.get_detection_audio(known_class_detection_id)
+        if not detection or not (detection['source_data_ref'] or detection['source_data']):
+            raise HTTPException(status_code=404, detail="Detection not found or not audio type")
+
+        range_header = request.headers.get("range")
+        if detection['source_data_ref']:
+            path = audio_processor.detection_blobs.path(detection['source_data_ref'])
+            if not os.path.exists(path):
+                raise HTTPException(status_code=404, detail="Detection audio missing from blob store")
+            media_type = DETECTION_CLIP_MEDIA_TYPES.get(detection['source_data_ref'].rsplit('.', 1)[-1], "application/octet-stream")
+            return range_file_response(path, media_type, range_header)
+        # Detections stored before the blob store keep a WAV in the row
+        return range_bytes_response(detection['source_data'], "audio/wav", range_header)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving audio data: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/get-detection-audio/{known_class_detection_id}")
 async def get_detection_audio(known_class_detection_id: str):
+    # Kept for links in notifications sent before /detection-audio existed
     try:
         # Query the database to get the source_data for the given id
-        query = """
-        SELECT source_data
-        FROM known_class_detections
-        WHERE id = %s AND source_data_type = 'audio'
-        """
-        result = db.sync_query(query, (known_class_detection_id,))
-
-        if not result:
+        detection = await async_db.get_detection_audio(known_class_detection_id)
+
+        if not detection or not (detection['source_data_ref'] or detection['source_data']):
             raise HTTPException(status_code=404, detail="Detection not found or not audio type")
-        audio_data = result[0][0]
 
-        # Convert the WAV data to base64
+        if detection['source_data_ref']:
+            try:
+                with open(audio_processor.detection_blobs.path(detection['source_data_ref']), 'rb') as f:
+                    audio_data = f.read()
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="Detection audio missing from blob store")
+        else:
+            audio_data = detection['source_data']
+
+        # Convert the audio data to base64
         audio_base64 = base64.b64encode(audio_data).decode('utf-8')
 
         return JSONResponse(content={"audio_base64": audio_base64})
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving audio data: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -287,6 +366,41 @@ async def embed_file(file: UploadFile = File(...)):
         except Exception as e:
             logger.error(f"Error deleting temporary file: {str(e)}")
 
+@app.post("/similar/{space}")
+async def similar(space: str, file: UploadFile = File(...), k: int = 10, device_id: int = None, hours_ago: float = None):
+    # Embeds an image or text upload like /embed and looks it up in the local vector index
+    if local_vector_index is None:
+        raise HTTPException(status_code=503, detail="Local vector index is disabled (set LOCAL_VECTOR_INDEX_DIR)")
+    if space not in local_vector_index.indexes:
+        raise HTTPException(status_code=404, detail=f"Vector space {space} is not indexed locally")
+    temp_file_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, mode='wb') as temp_file:
+            temp_file.write(await file.read())
+            temp_file_path = temp_file.name
+
+        if file.content_type.startswith('image/'):
+            embedding = embedding_service.embed_image(temp_file_path)[0]
+        elif file.content_type.startswith('audio/'):
+            embedding = embedding_service.embed_audio(temp_file_path)[0]
+        else:
+            with open(temp_file_path, 'r', encoding='utf-8', errors='replace') as f:
+                embedding = embedding_service.embed_text([f.read()])[0]
+
+        start_time = datetime.now(timezone.utc) - timedelta(hours=hours_ago) if hours_ago else None
+        results = local_vector_index.search(space, embedding, k, start_time=start_time, device_id=device_id)
+        return {"results": [{"id": id, "distance": distance} for id, distance in results]}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in similar: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+    finally:
+        if temp_file_path:
+            os.unlink(temp_file_path)
+
 @app.get("/embed-ui")
 async def embed_ui():
     html_content = """
@@ -372,11 +486,10 @@ async def verify_detection(request: Request, known_class_detection_id: str, name
                 }}
             }}
 
-            async function fetchAndPlayAudio() {{
-                const response = await fetch('{audio_url}');
-                const data = await response.json();
+            function fetchAndPlayAudio() {{
+                // The browser streams the clip with Range requests instead of a base64 JSON download
                 const audioPlayer = document.getElementById('audioPlayer');
-                audioPlayer.src = 'data:audio/wav;base64,' + data.audio_base64;
+                audioPlayer.src = '/detection-audio/{known_class_detection_id}';
                 audioPlayer.style.display = 'block';
                 audioPlayer.play();
             }}
@@ -410,13 +523,12 @@ async def verify_detection(request: Request, known_class_detection_id: str, name
 @app.post("/update-ground-truth/{known_class_detection_id}/{ground_truth}")
 async def update_ground_truth(known_class_detection_id: str, ground_truth: bool):
     try:
-        query = """
-        UPDATE known_class_detections
-        SET ground_truth = %s
-        WHERE id = %s
-        """
-        db.execute_query(query, (ground_truth, known_class_detection_id))
-        threading.Thread(target=audio_processor.update_known_classes, daemon=True).start()
+        # The update returns the detection's class and embedding, so only that class is retrained
+        detection = await async_db.update_ground_truth(known_class_detection_id, ground_truth)
+        if detection and detection['embedding'] is not None:
+            audio_processor.add_ground_truth(
+                known_class_detection_id, detection['known_class_id'], detection['embedding'], ground_truth
+            )
         return JSONResponse(status_code=200, content={"message": "Ground truth updated successfully"})
     except Exception as e:
         logger.error(f"Error updating ground truth: {str(e)}")
@@ -439,15 +551,19 @@ async def submit_browser_data(request: Request):
 async def gps_map(request: Request, start_date: str = None, end_date: str = None, days: int = 1):
     try:
         # Determine the time range for GPS data
-        end_time = datetime.utcnow()
+        # asyncpg reads naive datetimes as local time, so keep everything aware (naive input is UTC)
+        end_time = datetime.now(timezone.utc)
         if start_date and end_date:
             start_time = datetime.fromisoformat(start_date)
             end_time = datetime.fromisoformat(end_date)
+            if start_time.tzinfo is None:
+                start_time = start_time.replace(tzinfo=timezone.utc)
+            if end_time.tzinfo is None:
+                end_time = end_time.replace(tzinfo=timezone.utc)
         else:
             start_time = end_time - timedelta(days=days)
         
-        query = f"SELECT * FROM gps_data WHERE created_at >= '{start_time}' AND created_at <= '{end_time}' ORDER BY created_at DESC"
-        gps_data = db.sync_query(query)
+        gps_data = await async_db.get_gps_data(start_time, end_time)
 
         if not gps_data:
             raise HTTPException(status_code=404, detail="No GPS data found for the specified period")
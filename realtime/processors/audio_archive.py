@@ -0,0 +1,256 @@
+import datetime
+import glob
+import logging
+import os
+import struct
+import time
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+WAV_HEADER_SIZE = 44
+# Seek index record for compressed archives: first sample, byte offset, byte length of a frame
+INDEX_RECORD = struct.Struct("<QQI")
+
+
+def create_wav_header(sample_rate, bits_per_sample, channels, data_size):
+    byte_rate = (sample_rate * channels * bits_per_sample) // 8
+    block_align = (channels * bits_per_sample) // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample,
+        b"data", data_size
+    )
+
+
+class WavArchiveFile:
+    """
+    One day of one device as a PCM WAV file, kept open for appending.
+
+    The RIFF header is only rewritten on checkpoint() and close(); recover() repairs files
+    whose header fell behind because the process died in between.
+    """
+
+    extension = "wav"
+
+    def __init__(self, path, sample_rate, sample_width, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        exists = os.path.exists(path) and os.path.getsize(path) >= WAV_HEADER_SIZE
+        self.file = open(path, "r+b" if exists else "w+b", buffering=1024 * 1024)
+        if exists:
+            self.file.seek(0, os.SEEK_END)
+            self.data_size = self.file.tell() - WAV_HEADER_SIZE
+        else:
+            self.data_size = 0
+            self.file.write(self._header())
+
+    def _header(self):
+        return create_wav_header(self.sample_rate, self.sample_width * 8, self.channels, self.data_size)
+
+    def write(self, pcm_bytes):
+        self.file.write(pcm_bytes)
+        self.data_size += len(pcm_bytes)
+
+    def checkpoint(self):
+        self.file.seek(0)
+        self.file.write(self._header())
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+    @staticmethod
+    def recover(path, sample_rate, sample_width, channels):
+        size = os.path.getsize(path)
+        if size < WAV_HEADER_SIZE:
+            return False
+        frame_size = sample_width * channels
+        data_size = size - WAV_HEADER_SIZE
+        # Drop a partially written sample frame at the end
+        data_size -= data_size % frame_size
+        with open(path, "r+b") as f:
+            header = f.read(WAV_HEADER_SIZE)
+            recorded_size = struct.unpack_from("<I", header, 40)[0]
+            if recorded_size == data_size and size == WAV_HEADER_SIZE + data_size:
+                return False
+            f.truncate(WAV_HEADER_SIZE + data_size)
+            f.seek(0)
+            f.write(create_wav_header(sample_rate, sample_width * 8, channels, data_size))
+        return True
+
+
+class ZstdArchiveFile:
+    """
+    One day of one device as independent zstd frames of raw PCM plus a seek index.
+
+    PCM is collected into segments of segment_seconds; each segment becomes one frame, so
+    any time range can be decoded by seeking to the frame that contains it (see read_range).
+    """
+
+    extension = "pcm.zst"
+
+    def __init__(self, path, sample_rate, sample_width, channels, segment_seconds=60, level=3):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.sample_rate = sample_rate
+        self.frame_size = sample_width * channels
+        self.segment_bytes = segment_seconds * sample_rate * self.frame_size
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.file = open(path, "ab")
+        self.index = open(self.index_path, "ab")
+        self.byte_offset = self.file.tell()
+        self.samples_written = self._indexed_samples()
+        self.pending = bytearray()
+
+    def _indexed_samples(self):
+        entries = read_index(self.index_path)
+        if not entries:
+            return 0
+        first_sample, _, _ = entries[-1]
+        # The last frame's sample count isn't stored; decode it once on reopen
+        with open(self.path, "rb") as f:
+            f.seek(entries[-1][1])
+            frame = f.read(entries[-1][2])
+        return first_sample + len(zstandard.ZstdDecompressor().decompress(frame)) // self.frame_size
+
+    def write(self, pcm_bytes):
+        self.pending += pcm_bytes
+        if len(self.pending) >= self.segment_bytes:
+            self._write_segment()
+
+    def _write_segment(self):
+        if not self.pending:
+            return
+        frame = self.compressor.compress(bytes(self.pending))
+        self.file.write(frame)
+        self.file.flush()
+        self.index.write(INDEX_RECORD.pack(self.samples_written, self.byte_offset, len(frame)))
+        self.index.flush()
+        self.byte_offset += len(frame)
+        self.samples_written += len(self.pending) // self.frame_size
+        self.pending = bytearray()
+
+    def checkpoint(self):
+        self._write_segment()
+
+    def close(self):
+        self._write_segment()
+        self.file.close()
+        self.index.close()
+
+    @staticmethod
+    def recover(path, sample_rate, sample_width, channels):
+        index_path = path + ".idx"
+        repaired = False
+        entries = read_index(index_path)
+        data_size = os.path.getsize(path)
+        # Records whose frame didn't make it to disk
+        while entries and entries[-1][1] + entries[-1][2] > data_size:
+            entries.pop()
+        index_size = len(entries) * INDEX_RECORD.size
+        if os.path.exists(index_path) and os.path.getsize(index_path) != index_size:
+            # Also drops a partially written record, which would misalign every record appended after it
+            with open(index_path, "r+b") as f:
+                f.truncate(index_size)
+            repaired = True
+        end = entries[-1][1] + entries[-1][2] if entries else 0
+        if data_size > end:
+            # A frame was written but its index record wasn't
+            with open(path, "r+b") as f:
+                f.truncate(end)
+            repaired = True
+        return repaired
+
+
+def read_index(index_path):
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    return [INDEX_RECORD.unpack_from(data, offset) for offset in range(0, usable, INDEX_RECORD.size)]
+
+
+def read_range(path, start_sample, end_sample, frame_size=2):
+    """Decode PCM for [start_sample, end_sample) from a zstd archive using its seek index."""
+    decompressor = zstandard.ZstdDecompressor()
+    out = bytearray()
+    entries = read_index(path + ".idx")
+    with open(path, "rb") as f:
+        for i, (first_sample, byte_offset, byte_length) in enumerate(entries):
+            # Decide from the index alone; only frames overlapping the range are decoded
+            if first_sample >= end_sample:
+                break
+            if i + 1 < len(entries) and entries[i + 1][0] <= start_sample:
+                continue
+            f.seek(byte_offset)
+            pcm = decompressor.decompress(f.read(byte_length))
+            last_sample = first_sample + len(pcm) // frame_size
+            if last_sample <= start_sample:
+                continue
+            lo = max(start_sample - first_sample, 0) * frame_size
+            hi = (min(end_sample, last_sample) - first_sample) * frame_size
+            out += pcm[lo:hi]
+    return bytes(out)
+
+
+class AudioArchive:
+    """
+    Long term audio storage: one open file per device per day, rotated at midnight.
+
+    Headers/segments are checkpointed every checkpoint_interval seconds instead of on every
+    packet. format is "wav" (default) or "zstd" for compressed segments with a seek index.
+    """
+
+    def __init__(self, directory, sample_rate, sample_width, channels, format="wav", checkpoint_interval=30):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.file_class = ZstdArchiveFile if format == "zstd" else WavArchiveFile
+        self.checkpoint_interval = checkpoint_interval
+        self.files = {}
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+    def path_for(self, device_id, day):
+        return os.path.join(self.directory, f"{device_id}_{day}.{self.file_class.extension}")
+
+    def recover(self):
+        for path in glob.glob(os.path.join(self.directory, f"*.{self.file_class.extension}")):
+            try:
+                if self.file_class.recover(path, self.sample_rate, self.sample_width, self.channels):
+                    logger.info(f"Repaired audio archive {path}")
+            except Exception as e:
+                logger.error(f"Error repairing audio archive {path}: {e}")
+
+    def write(self, device_id, pcm_bytes):
+        day = datetime.datetime.now().strftime("%Y-%m-%d")
+        entry = self.files.get(device_id)
+        if entry is None or entry["day"] != day:
+            if entry is not None:
+                entry["file"].close()
+            archive_file = self.file_class(self.path_for(device_id, day), self.sample_rate, self.sample_width, self.channels)
+            entry = {"day": day, "file": archive_file, "checkpointed_at": time.monotonic()}
+            self.files[device_id] = entry
+
+        entry["file"].write(pcm_bytes)
+        if time.monotonic() - entry["checkpointed_at"] >= self.checkpoint_interval:
+            entry["file"].checkpoint()
+            entry["checkpointed_at"] = time.monotonic()
+        return entry["file"].path
+
+    def close_device(self, device_id):
+        entry = self.files.pop(device_id, None)
+        if entry is not None:
+            entry["file"].close()
+
+    def close(self):
+        for device_id in list(self.files):
+            self.close_device(device_id)
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from websockets.sync.client import connect
+from websockets.exceptions import ConnectionClosed
+from processors.ring_buffer import AudioRingBuffer
+from processors.resample import StreamingResampler, float32_to_pcm16
+
+logger = logging.getLogger(__name__)
+
+
+# whisper_server closes connections beyond its --max-sessions with this code
+WHISPER_TRY_AGAIN_LATER = 1013
+# Longest wait between whisper reconnect attempts after failures or refusals
+MAX_RECONNECT_DELAY = 60
+
+
+class AudioSession:
+    """
+    Audio state for one streaming device: its whisper stream, classification buffer and
+    classification cadence. AudioProcessor keeps one per device_id and evicts idle ones.
+
+    The whisper stream connects on a background thread, never on the event loop. After a
+    failed connect or a refusal, reconnects back off exponentially up to MAX_RECONNECT_DELAY;
+    audio arriving while disconnected isn't sent.
+    """
+
+    def __init__(self, device_id, db, whisper_url, sample_rate=8000, window_seconds=5, hop_seconds=5, asr_sample_rate=16000):
+        self.device_id = device_id
+        self.db = db
+        self.sample_rate = sample_rate
+        self.audio_start_time = None
+        self.today_wav_file_path = None
+        self.last_active = time.monotonic()
+
+        # Windows waiting on the CLAP worker; the session isn't evicted while any are in flight
+        self.pending_classifications = 0
+        self.classification_buffer = AudioRingBuffer(
+            window_size=window_seconds * sample_rate,
+            hop_size=hop_seconds * sample_rate
+        )
+
+        self.whisper_ws = None
+        self.whisper_url = whisper_url
+        # Keeps filter state across chunks so the whisper stream has no seams
+        self.asr_resampler = StreamingResampler(sample_rate, asr_sample_rate)
+        self._closed = False
+        self._connecting = False
+        self._reconnect_delay = 0
+        self._next_connect = 0
+        self.connect_to_whisper()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_active
+
+    def on_message(self, message):
+        logger.info(f"Received message from whisper-streaming for device {self.device_id}: {message}")
+        # Process the received transcription here
+        self.db.insert_speech_data(message, json.dumps({}), None, None, self.device_id)
+
+    def connect_to_whisper(self):
+        """Start connecting in the background unless connected, connecting or backing off."""
+        if self._closed or self._connecting or self.whisper_ws is not None or time.monotonic() < self._next_connect:
+            return
+        self._connecting = True
+        logger.info(f"Connecting to whisper-streaming for device {self.device_id}")
+        threading.Thread(target=self._connect, daemon=True).start()
+
+    def _connect(self):
+        try:
+            whisper_ws = connect(self.whisper_url, open_timeout=10)
+        except Exception as e:
+            logger.error(f"Failed to connect to whisper-streaming: {e}")
+            self._back_off()
+            self._connecting = False
+            return
+        if self._closed:
+            whisper_ws.close()
+            self._connecting = False
+            return
+        self.whisper_ws = whisper_ws
+        self._connecting = False
+        logger.info(f"Connected to whisper-streaming WebSocket for device {self.device_id}")
+
+        # Start a background thread to handle incoming messages
+        threading.Thread(target=self.receive_messages, args=(whisper_ws,), daemon=True).start()
+
+    def _back_off(self):
+        self._reconnect_delay = min(max(self._reconnect_delay * 2, 1), MAX_RECONNECT_DELAY)
+        self._next_connect = time.monotonic() + self._reconnect_delay
+        logger.info(f"Next whisper-streaming connect for device {self.device_id} in {self._reconnect_delay}s")
+
+    def receive_messages(self, whisper_ws):
+        while True:
+            try:
+                message = whisper_ws.recv()
+                # A transcript means this connection was accepted
+                self._reconnect_delay = 0
+                self.on_message(message)
+            except ConnectionClosed as e:
+                if self.whisper_ws is whisper_ws:
+                    self.whisper_ws = None
+                if self._closed:
+                    break
+                if e.rcvd is not None and e.rcvd.code == WHISPER_TRY_AGAIN_LATER:
+                    logger.warning(f"whisper-streaming refused device {self.device_id}: {e.rcvd.reason}")
+                    self._back_off()
+                else:
+                    # Closed after being accepted (e.g. evicted as idle); reconnect on the next chunk
+                    logger.info(f"whisper-streaming connection closed for device {self.device_id}: {e}")
+                    self._reconnect_delay = 0
+                break
+            except Exception as e:
+                if self.whisper_ws is whisper_ws:
+                    self.whisper_ws = None
+                if not self._closed:
+                    logger.error(f"Error receiving message: {e}")
+                break
+
+    def send_audio_to_whisper(self, samples):
+        """samples: float32 audio at the session's sample rate."""
+        if self.whisper_ws is None:
+            self.connect_to_whisper()
+
+        # Resample even while disconnected so the filter state follows the stream
+        int16_data = float32_to_pcm16(self.asr_resampler.process(samples))
+        whisper_ws = self.whisper_ws
+        if whisper_ws:
+            try:
+                # Send the audio data as an ArrayBuffer
+                whisper_ws.send(int16_data.tobytes())
+
+            except Exception as e:
+                logger.error(f"==================== Error sending audio to whisper-streaming: {e}")
+                if self.whisper_ws is whisper_ws:
+                    self.whisper_ws = None
+
+    def close(self):
+        self._closed = True
+        if self.whisper_ws is not None:
+            try:
+                self.whisper_ws.close()
+            except Exception as e:
+                logger.error(f"Error closing whisper-streaming WebSocket: {e}")
+            self.whisper_ws = None
+        logger.info(f"Closed audio session for device {self.device_id}")
@@ -0,0 +1,45 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """
+    Content-addressed files on disk: a blob's key is the sha256 of its bytes plus an extension.
+
+    Blobs live at <directory>/<2 hex>/<2 hex>/<key>, are written once through a temp file and
+    os.replace, and are never modified, so identical clips are stored once and a key in a
+    database row always points at complete data.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        name = os.path.basename(key)
+        if name != key or not name or name.startswith("."):
+            raise ValueError(f"Invalid blob key {key!r}")
+        return os.path.join(self.directory, name[:2], name[2:4], name)
+
+    def put(self, data, extension):
+        key = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        return key
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
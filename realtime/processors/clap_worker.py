@@ -0,0 +1,113 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import torch
+from processors.resample import resample
+
+logger = logging.getLogger(__name__)
+
+CLAP_SAMPLE_RATE = 48000
+
+
+class ClapInferenceWorker:
+    """
+    Runs CLAP audio embeddings on a dedicated thread, off the event loop.
+
+    Windows from all devices go into one bounded queue; the worker takes whatever is waiting
+    (up to max_batch, waiting at most max_wait seconds for more) and embeds it with a single
+    forward pass. submit() returns a concurrent.futures.Future with the (1, dim) embedding,
+    so async callers can await it with asyncio.wrap_future. When the queue is full new
+    windows are dropped and counted instead of blocking the caller. The model and processor
+    come from the shared model registry under model_name, loaded on the first batch.
+    """
+
+    def __init__(self, models, model_name="clap", max_batch=8, max_wait=0.05, max_queue=64):
+        self.models = models
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.windows_submitted = 0
+        self.windows_dropped = 0
+        self.windows_embedded = 0
+        self.batches = 0
+        self._stop = object()
+        self._thread = threading.Thread(target=self._run, name="clap-inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, samples, sample_rate):
+        """Queue a float32 window for embedding. Returns None if it had to be dropped."""
+        future = Future()
+        try:
+            self.queue.put_nowait((samples, sample_rate, future))
+        except queue.Full:
+            self.windows_dropped += 1
+            return None
+        self.windows_submitted += 1
+        return future
+
+    def _next_batch(self):
+        item = self.queue.get()
+        if item is self._stop:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._stop:
+                # Finish what was collected, then stop
+                self.queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            futures = [future for _, _, future in batch]
+            try:
+                embeddings = self.embed([resample(samples, sr, CLAP_SAMPLE_RATE) for samples, sr, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} audio windows: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, embedding in zip(futures, embeddings):
+                future.set_result(embedding[np.newaxis, :])
+            self.batches += 1
+            self.windows_embedded += len(futures)
+
+    def embed(self, audios):
+        with self.models.use(self.model_name) as (model, processor), torch.inference_mode():
+            inputs = processor(audios=audios, return_tensors="pt", sampling_rate=CLAP_SAMPLE_RATE)
+            return model.get_audio_features(**inputs).numpy()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "windows_submitted": self.windows_submitted,
+            "windows_dropped": self.windows_dropped,
+            "windows_embedded": self.windows_embedded,
+            "batches": self.batches,
+            "mean_batch_size": self.windows_embedded / self.batches if self.batches else 0.0,
+        }
+
+    def close(self, timeout=5):
+        try:
+            self.queue.put(self._stop, timeout=timeout)
+        except queue.Full:
+            logger.error("CLAP inference queue still full on shutdown")
+            return
+        self._thread.join(timeout)
@@ -0,0 +1,70 @@
+import numpy as np
+from scipy.special import expit
+
+
+class KnownClassScorer:
+    """
+    All known-class scorers packed into one matrix, so a window is scored with a single matmul.
+
+    Row i holds class_ids[i]'s linear decision function (weights[i], bias[i]) and its Platt
+    scaling (platt_a[i], platt_b[i]); score = sigmoid(platt_a * (w . x + b) + platt_b).
+    Rows built from a raw known_classes.embedding centroid have calibrated[i] = False and
+    score as plain cosine similarity (CLAP embeddings are unit length).
+    """
+
+    def __init__(self, class_ids, weights, bias, platt_a, platt_b, calibrated):
+        self.class_ids = list(class_ids)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.platt_a = np.asarray(platt_a, dtype=np.float32)
+        self.platt_b = np.asarray(platt_b, dtype=np.float32)
+        self.calibrated = np.asarray(calibrated, dtype=bool)
+
+    @classmethod
+    def empty(cls, dim=0):
+        return cls([], np.zeros((0, dim)), [], [], [], [])
+
+    @classmethod
+    def from_classifiers(cls, known_classes, classifiers, include_centroids=False):
+        """
+        Pack linear classifiers keyed by class id: SVC(probability=True) or logistic models such
+        as SGDClassifier(loss="log_loss"). With include_centroids, classes without a classifier
+        fall back to their known_classes.embedding centroid.
+        """
+        rows = []
+        for known_class in known_classes:
+            class_id = known_class['id']
+            classifier = classifiers.get(class_id)
+            if classifier is not None:
+                if hasattr(classifier, 'probA_'):
+                    # libsvm's binary Platt scaling: P(positive) = 1 / (1 + exp(probA * f - probB))
+                    platt_a, platt_b = -classifier.probA_[0], classifier.probB_[0]
+                else:
+                    # Logistic models already give P(positive) = sigmoid(f)
+                    platt_a, platt_b = 1.0, 0.0
+                rows.append((class_id, classifier.coef_[0], classifier.intercept_[0], platt_a, platt_b, True))
+            elif include_centroids and known_class.get('embedding') is not None:
+                centroid = np.asarray(known_class['embedding'], dtype=np.float32)
+                norm = np.linalg.norm(centroid)
+                if norm > 0:
+                    rows.append((class_id, centroid / norm, 0.0, 1.0, 0.0, False))
+
+        if not rows:
+            return cls.empty()
+        dims = {len(row[1]) for row in rows}
+        if len(dims) != 1:
+            raise ValueError(f"Known class scorers have mismatched dimensions: {sorted(dims)}")
+        class_ids, weights, bias, platt_a, platt_b, calibrated = zip(*rows)
+        return cls(class_ids, np.stack(weights), bias, platt_a, platt_b, calibrated)
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def score(self, embeddings):
+        """embeddings: (n, dim) or (dim,). Returns (n, n_classes) scores in class_ids order."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not self.class_ids:
+            return np.zeros((len(embeddings), 0), dtype=np.float32)
+        decision = embeddings @ self.weights.T + self.bias
+        probability = expit(self.platt_a * decision + self.platt_b)
+        return np.where(self.calibrated, probability, decision)
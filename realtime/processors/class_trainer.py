@@ -0,0 +1,197 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalClassTrainer:
+    """
+    One online logistic regression per known class, updated with partial_fit.
+
+    fit() trains every class from the full labeled set (startup). add_label() only queues a
+    label; a flush runs once no label has arrived for debounce_seconds (or max_delay_seconds
+    after the first queued label, for a steady stream of clicks). All queued labels are applied
+    in that one pass, the last label per detection winning, and only their classes are touched.
+    Each update also replays a sample of earlier labeled rows: the class's own, and other
+    classes' as negatives, so a burst of one-sided clicks doesn't drag a model to one answer.
+    Updated models are trained on copies and published by replacing self.models in one
+    assignment, then on_update(models) is called, so readers never see a half-trained model.
+    """
+
+    def __init__(self, on_update=None, debounce_seconds=2.0, max_delay_seconds=None, epochs=5, alpha=1e-4, replay_samples=64, replay_per_class=512):
+        self.on_update = on_update
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds if max_delay_seconds is not None else 5 * debounce_seconds
+        self.epochs = epochs
+        self.alpha = alpha
+        self.replay_samples = replay_samples
+        self.replay_per_class = replay_per_class
+        self.models = {}
+        # class_id -> OrderedDict(detection_id -> (embedding, ground_truth)), newest last
+        self._replay = {}
+        self._rng = np.random.default_rng(0)
+        self._pending = {}
+        self._pending_since = None
+        self._pending_lock = threading.Lock()
+        self._train_lock = threading.Lock()
+        self._timer = None
+
+    def _new_model(self):
+        return SGDClassifier(loss="log_loss", alpha=self.alpha, random_state=0)
+
+    def _partial_fit(self, model, X, y):
+        for _ in range(self.epochs):
+            model.partial_fit(X, y, classes=[0, 1])
+
+    def _remember(self, detection_id, class_id, embedding, ground_truth):
+        rows = self._replay.setdefault(class_id, OrderedDict())
+        rows.pop(detection_id, None)
+        rows[detection_id] = (embedding, ground_truth)
+        if len(rows) > self.replay_per_class:
+            rows.popitem(last=False)
+
+    def _replay_rows(self, class_id, skip):
+        """Up to replay_samples earlier rows of class_id and as many of other classes (as negatives)."""
+        own = [row for detection_id, row in self._replay.get(class_id, {}).items() if detection_id not in skip]
+        others = [
+            (embedding, False)
+            for other_id, rows in self._replay.items() if other_id != class_id
+            for detection_id, (embedding, _) in rows.items() if detection_id not in skip
+        ]
+        sample = []
+        for rows in (own, others):
+            for i in self._rng.choice(len(rows), min(len(rows), self.replay_samples), replace=False):
+                sample.append(rows[i])
+        return sample
+
+    def fit(self, detections):
+        """detections: iterable of (detection_id, class_id, embedding, ground_truth) for every labeled detection."""
+        class_embeddings = {}
+        replay = {}
+        for detection_id, class_id, embedding, ground_truth in detections:
+            class_embeddings.setdefault(class_id, {'positive': [], 'negative': []})
+            class_embeddings[class_id]['positive' if ground_truth else 'negative'].append(embedding)
+            replay.setdefault(class_id, []).append((detection_id, np.asarray(embedding, dtype=np.float32), bool(ground_truth)))
+
+        models = {}
+        for class_id, embeddings in class_embeddings.items():
+            if not embeddings['positive']:
+                continue
+            negative_embeddings = list(embeddings['negative'])
+            # Use all other classes' embeddings as negative samples
+            for other_class_id, other_embeddings in class_embeddings.items():
+                if other_class_id != class_id:
+                    negative_embeddings.extend(other_embeddings['positive'])
+                    negative_embeddings.extend(other_embeddings['negative'])
+
+            X = np.array(embeddings['positive'] + negative_embeddings, dtype=np.float32)
+            y = [1] * len(embeddings['positive']) + [0] * len(negative_embeddings)
+            model = self._new_model()
+            self._partial_fit(model, X, y)
+            models[class_id] = model
+
+        with self._train_lock:
+            self.models = models
+            self._replay = {}
+            self._add_replay(replay)
+            self._publish(models)
+        return models
+
+    def seed_replay(self, detections):
+        """Fill the replay sample from labeled detections without retraining (models came from the cache)."""
+        replay = {}
+        for detection_id, class_id, embedding, ground_truth in detections:
+            replay.setdefault(class_id, []).append((detection_id, np.asarray(embedding, dtype=np.float32), bool(ground_truth)))
+        with self._train_lock:
+            self._add_replay(replay)
+
+    def _add_replay(self, replay):
+        for class_id, rows in replay.items():
+            # Keep the newest rows of each class
+            for detection_id, embedding, ground_truth in rows[-self.replay_per_class:]:
+                self._remember(detection_id, class_id, embedding, ground_truth)
+
+    def load(self, models):
+        """Adopt previously trained models (e.g. from ClassifierCache) without calling on_update."""
+        with self._train_lock:
+            self.models = dict(models)
+
+    def add_label(self, detection_id, class_id, embedding, ground_truth):
+        with self._pending_lock:
+            self._pending[detection_id] = (class_id, np.asarray(embedding, dtype=np.float32), bool(ground_truth))
+            now = time.monotonic()
+            if self._pending_since is None:
+                self._pending_since = now
+            # Every click restarts the wait, up to max_delay_seconds after the first queued one
+            delay = min(self.debounce_seconds, max(self._pending_since + self.max_delay_seconds - now, 0))
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def has_pending(self):
+        with self._pending_lock:
+            return bool(self._pending)
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._pending_since = None
+            self._timer = None
+        if not pending:
+            return
+
+        by_class = {}
+        for class_id, embedding, ground_truth in pending.values():
+            by_class.setdefault(class_id, ([], []))
+            by_class[class_id][0].append(embedding)
+            by_class[class_id][1].append(1 if ground_truth else 0)
+
+        with self._train_lock:
+            models = dict(self.models)
+            for class_id, (X, y) in by_class.items():
+                # Relabeled detections are replayed with their new label only
+                for embedding, ground_truth in self._replay_rows(class_id, skip=pending):
+                    X.append(embedding)
+                    y.append(1 if ground_truth else 0)
+                model = models.get(class_id)
+                if model is None:
+                    if 1 not in y:
+                        # A class needs a confirmed detection before it can be scored
+                        continue
+                    model = self._new_model()
+                else:
+                    model = copy.deepcopy(model)
+                try:
+                    self._partial_fit(model, np.stack(X), y)
+                except Exception as e:
+                    logger.error(f"Error updating classifier for class {class_id}: {e}")
+                    continue
+                models[class_id] = model
+            for detection_id, (class_id, embedding, ground_truth) in pending.items():
+                self._remember(detection_id, class_id, embedding, ground_truth)
+            self.models = models
+            # Published under the lock so two flushes can't publish out of order
+            self._publish(models)
+        logger.info(f"Updated classifiers for {len(by_class)} classes from {len(pending)} labels")
+
+    def _publish(self, models):
+        if self.on_update is not None:
+            try:
+                self.on_update(models)
+            except Exception as e:
+                logger.error(f"Error publishing updated classifiers: {e}")
+
+    def close(self):
+        with self._pending_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
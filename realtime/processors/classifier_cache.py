@@ -0,0 +1,57 @@
+import logging
+import os
+import pickle
+import sklearn
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = 1
+
+
+class ClassifierCache:
+    """
+    Trained known-class classifiers pickled to disk, so startup doesn't wait for a retrain.
+
+    An entry records the labeled-set watermark it was trained on and the embedding model the
+    labels were embedded with. It is ignored when the embedding model or scikit-learn version
+    differs; callers compare the watermark with the database to decide whether to retrain.
+    """
+
+    def __init__(self, path, embedding_model):
+        self.path = path
+        self.embedding_model = embedding_model
+
+    def load(self):
+        """Returns (watermark, models), or (None, {}) when there is no usable cache."""
+        if not os.path.exists(self.path):
+            return None, {}
+        try:
+            with open(self.path, "rb") as f:
+                entry = pickle.load(f)
+        except Exception as e:
+            logger.error(f"Error reading classifier cache {self.path}: {e}")
+            return None, {}
+        if (entry.get("format") != CACHE_FORMAT
+                or entry.get("embedding_model") != self.embedding_model
+                or entry.get("sklearn_version") != sklearn.__version__):
+            logger.info(f"Ignoring classifier cache {self.path} built for a different model or scikit-learn")
+            return None, {}
+        return entry["watermark"], entry["models"]
+
+    def save(self, watermark, models):
+        entry = {
+            "format": CACHE_FORMAT,
+            "embedding_model": self.embedding_model,
+            "sklearn_version": sklearn.__version__,
+            "watermark": watermark,
+            "models": models,
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Readers only ever see a complete file
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error writing classifier cache {self.path}: {e}")
@@ -2,28 +2,32 @@ import threading
 import datetime
 import base64 
 import os 
-import zstd
+import zstandard
 import json
 import asyncio
 import numpy as np
-import wave
 from fastapi import HTTPException
 import sys
 import os
-from transformers import ClapModel, ClapProcessor
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn import svm
 import logging
-import librosa
-import psycopg2
 import io
-import scipy.io.wavfile
-from websockets.sync.client import connect
+import time
+import soundfile
+from processors.audio_session import AudioSession
+from processors.audio_archive import AudioArchive
+from processors.resample import pcm16_to_float32
+from processors.clap_worker import ClapInferenceWorker
+from processors.blob_store import BlobStore
+from processors.class_scorer import KnownClassScorer
+from processors.class_trainer import IncrementalClassTrainer
+from processors.classifier_cache import ClassifierCache
 
 # Add the directory containing whisper_streaming to the Python path
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
-from libraries.gotify.gotify import send_gotify_message
+from libraries.gotify.gotify import send_gotify_message, get_rate_state
 from libraries.db.db import DB
+from libraries.embed.models import get_registry, CLAP_MODEL
 
 # Set up logging
 log_file = 'process_audio.log'
@@ -33,231 +37,300 @@ logger = logging.getLogger(__name__)
 
 SERVER_START_TIME = int(datetime.datetime.now().timestamp())
 
+# Detection clip codecs; a clip's blob key ends in the codec name
+DETECTION_CLIP_MEDIA_TYPES = {"flac": "audio/flac", "opus": "audio/ogg"}
+
 class AudioProcessor:
-    def __init__(self, db_interface):
+    def __init__(self, db_interface, async_db):
         self.db = db_interface
+        self.async_db = async_db
         self.known_classes = self.db.get_known_classes(type='audio')
-        self.audio_start_time = None
         self.sample_rate = 8000
         self.channels = 1
         self.sample_width = 2
-        self.speech_probs = []
-        self.audio_frame_cache = []
-        self.speech_detected = False
-        self.device_id = 1
-        self.last_speech_detected = 0
-        if not os.path.exists("audio/persistent"):
-            os.makedirs("audio/persistent")
+        # Long term storage: one open file per device per day, repaired on startup after a crash
+        self.archive = AudioArchive(
+            "audio/persistent", self.sample_rate, self.sample_width, self.channels,
+            format=os.getenv("AUDIO_ARCHIVE_FORMAT", "wav")
+        )
+        # Detection clips are compressed and stored by content hash; rows only keep the key
+        self.detection_blobs = BlobStore(os.getenv("AUDIO_DETECTION_BLOB_DIR", "audio/detections"))
+        self.detection_clip_codec = os.getenv("AUDIO_DETECTION_CODEC", "flac")
+        if self.detection_clip_codec not in DETECTION_CLIP_MEDIA_TYPES:
+            logger.error(f"Unknown AUDIO_DETECTION_CODEC {self.detection_clip_codec}, using flac")
+            self.detection_clip_codec = "flac"
         logger.info("AudioProcessor initialized")
 
-        # initialize streamed whisper
-        # Initialize WebSocket connection to whisper-streaming
-        self.whisper_ws = None
+        # One session per streaming device: whisper stream, classification buffer and cadence
         self.whisper_url = "ws://whisper-pino:43007/"
-        self.connect_to_whisper()
+        self.sessions = {}
+        self.session_idle_timeout = int(os.getenv("AUDIO_SESSION_IDLE_SECONDS", 300))
+        # Classification windows: 5 s long, a new one every hop (hop < window overlaps them)
+        self.classification_window_seconds = 5
+        self.classification_hop_seconds = float(os.getenv("AUDIO_CLASSIFICATION_HOP_SECONDS", 5))
+        # Started by start() on the server's loop, so idle sessions close even when no audio arrives
+        self.eviction_task = None
+        # known_classes edits are picked up this often (and after every retrain)
+        self.known_classes_refresh_seconds = float(os.getenv("AUDIO_KNOWN_CLASSES_REFRESH_SECONDS", 60))
+        self.known_classes_task = None
+
+        # Last-sent notification times, seeded from gotify_message_log once and kept in memory
+        self.rate_state = get_rate_state()
+        self.rate_state.seed()
+
+        # zero shot audio classification; CLAP is shared with EmbeddingService through the model registry
+        self.clap_model_name = CLAP_MODEL
+        # Windows from every device are embedded in micro-batches on one inference thread
+        self.clap_worker = ClapInferenceWorker(
+            get_registry(), "clap",
+            max_batch=int(os.getenv("CLAP_BATCH_SIZE", 8)),
+            max_wait=float(os.getenv("CLAP_BATCH_WAIT_MS", 50)) / 1000,
+            max_queue=int(os.getenv("CLAP_QUEUE_SIZE", 64))
+        )
+        self.last_clap_stats_log = time.monotonic()
+        # classify_window tasks still running
+        self.classification_tasks = set()
+
+        # Reused for every packet instead of setting up a new zstd context each time
+        self.decompressor = zstandard.ZstdDecompressor()
+
+        # One online classifier per known class; ground truth clicks update them incrementally
+        # Classes without labeled detections can optionally score against their known_classes.embedding
+        self.use_class_centroids = os.getenv("AUDIO_CLASS_CENTROID_FALLBACK", "false").lower() == "true"
+        self.class_scorer = KnownClassScorer.empty()
+        self.class_trainer = IncrementalClassTrainer(
+            on_update=self.on_classifiers_trained,
+            debounce_seconds=float(os.getenv("AUDIO_RETRAIN_DEBOUNCE_SECONDS", 2))
+        )
+        # Start from the cached classifiers; retrain in the background only if labels changed
+        self.classifier_cache = ClassifierCache(
+            os.getenv("AUDIO_CLASSIFIER_CACHE", "audio/models/known_class_classifiers.pkl"),
+            self.clap_model_name
+        )
+        self.load_classifiers()
 
-        # zero shot audio classification
-        self.audio_classification_buffer_path = "audio/temp_classification_buffer.wav"
-        self.clap_model = ClapModel.from_pretrained("laion/clap-htsat-unfused")
-        self.clap_processor = ClapProcessor.from_pretrained("laion/clap-htsat-unfused")
-        self.classification_lock = asyncio.Lock()
+    def update_known_classes(self, classifiers=None):
+        """Reload known_classes (new classes, names, thresholds) and republish the scorer."""
+        try:
+            self.known_classes = self.db.get_known_classes(type='audio')
+        except Exception as e:
+            logger.error(f"Error reloading known classes, keeping the previous ones: {e}")
+        self.publish_classifiers(classifiers if classifiers is not None else self.class_trainer.models)
 
-        # Initialize SVM classifiers for each known class
-        self.svm_classifiers = {}
-        self.train_svm_classifiers()
+    def add_ground_truth(self, detection_id, known_class_id, embedding, ground_truth):
+        # Coalesced with other clicks and applied to this class only, off the request path
+        self.class_trainer.add_label(detection_id, known_class_id, embedding, ground_truth)
 
-    def update_known_classes(self):
-        self.known_classes = self.db.get_known_classes(type='audio')
-        logger.info("Updated known_classes")
-        self.train_svm_classifiers()
+    def publish_classifiers(self, classifiers):
+        # A single assignment swaps the scorer, so windows in flight keep a consistent one
+        self.class_scorer = KnownClassScorer.from_classifiers(
+            self.known_classes, classifiers, include_centroids=self.use_class_centroids
+        )
+
+    def on_classifiers_trained(self, classifiers):
+        # Labels may be for classes added or edited since the last reload
+        self.update_known_classes(classifiers)
+        if self.class_trainer.has_pending:
+            # Labels already in the database aren't in these models yet; the next flush saves
+            return
+        watermark = self.labeled_watermark()
+        if watermark is not None:
+            self.classifier_cache.save(watermark, classifiers)
 
-    def train_svm_classifiers(self):
-        # Query for all known_class_detections with a ground_truth (true or false, not Null)
-        known_class_detections = self.db.sync_query(
+    def labeled_watermark(self):
+        # Changes whenever a detection is labeled or relabeled; reads no embeddings
+        result = self.db.sync_query(
             """
-            SELECT known_class_id, embedding, ground_truth 
-            FROM known_class_detections 
+            SELECT COUNT(*), COALESCE(md5(string_agg(id::text || ground_truth::text, ',' ORDER BY id)), '')
+            FROM known_class_detections
             WHERE ground_truth IS NOT NULL
             """
         )
+        if not result:
+            return None
+        return f"{result[0][0]}:{result[0][1]}"
+
+    def load_classifiers(self):
+        watermark, classifiers = self.classifier_cache.load()
+        if classifiers:
+            self.class_trainer.load(classifiers)
+            self.publish_classifiers(classifiers)
+            logger.info(f"Loaded {len(classifiers)} cached classifiers for known classes")
+        threading.Thread(target=self.refresh_classifiers, args=(watermark,), daemon=True).start()
+
+    def refresh_classifiers(self, cached_watermark):
+        try:
+            if cached_watermark is not None and self.labeled_watermark() == cached_watermark:
+                logger.info("Cached classifiers are up to date with labeled detections")
+                # Incremental updates still replay earlier labels alongside new clicks
+                detections = self.load_labeled_detections()
+                if detections is not None:
+                    self.class_trainer.seed_replay(detections)
+                return
+            self.train_classifiers()
+        except Exception as e:
+            logger.error(f"Error retraining classifiers for known classes: {e}")
 
-        # Prepare data for training SVM classifiers
-        class_embeddings = {}
-        for detection in known_class_detections:
-            class_id = detection[0]
-            embedding = np.array(json.loads(detection[1]), dtype=np.float32)
-            ground_truth = detection[2]
-
-            if class_id not in class_embeddings:
-                class_embeddings[class_id] = {'positive': [], 'negative': []}
-
-            if ground_truth:
-                class_embeddings[class_id]['positive'].append(embedding)
-            else:
-                class_embeddings[class_id]['negative'].append(embedding)
-
-        # Train an SVM for each known class
-        for class_id, embeddings in class_embeddings.items():
-            positive_embeddings = embeddings['positive']
-            negative_embeddings = []
-
-            # Use all other classes' embeddings as negative samples
-            for other_class_id, other_embeddings in class_embeddings.items():
-                if other_class_id != class_id:
-                    negative_embeddings.extend(other_embeddings['positive'])
-                    negative_embeddings.extend(other_embeddings['negative'])
-
-            X = positive_embeddings + negative_embeddings
-            y = [1] * len(positive_embeddings) + [0] * len(negative_embeddings)
-
-            classifier = svm.SVC(kernel='linear', probability=True)
-            classifier.fit(X, y)
-            self.svm_classifiers[class_id] = classifier
-
-        logger.info("Trained SVM classifiers for known classes")
-
-    def on_message(self, message):
-        logger.info(f"Received message from whisper-streaming: {message}")
-        # Process the received transcription here
-        threading.Thread(target=lambda: self.db.insert_speech_data(message, json.dumps({}), None, None, self.device_id), daemon=True).start()
-
-    def connect_to_whisper(self):
+    def load_labeled_detections(self):
+        # All known_class_detections with a ground_truth (true or false, not Null), embeddings
+        # loaded over binary COPY into one float32 matrix
         try:
-            self.whisper_ws = connect(self.whisper_url)
-            logger.info("Connected to whisper-streaming WebSocket")
-            
-            # Start a background thread to handle incoming messages
-            threading.Thread(target=self.receive_messages, daemon=True).start()
+            rows, embeddings = self.db.fetch_vectors(
+                """
+                SELECT id::text, known_class_id::text, ground_truth::text, embedding
+                FROM known_class_detections
+                WHERE ground_truth IS NOT NULL
+                ORDER BY id
+                """
+            )
         except Exception as e:
-            logger.error(f"Failed to connect to whisper-streaming: {e}")
-            self.whisper_ws = None
-    
-    def receive_messages(self):
+            logger.error(f"Error loading labeled detections: {e}")
+            return None
+        return [
+            (detection_id, class_id, embedding, ground_truth == 'true')
+            for (detection_id, class_id, ground_truth), embedding in zip(rows, embeddings)
+        ]
+
+    def train_classifiers(self):
+        detections = self.load_labeled_detections()
+        if detections is None:
+            return
+        self.class_trainer.fit(detections)
+        logger.info(f"Trained classifiers for known classes ({len(self.class_scorer)} scored)")
+
+    def get_session(self, device_id):
+        session = self.sessions.get(device_id)
+        if session is None:
+            logger.info(f"Starting audio session for device {device_id}")
+            session = AudioSession(
+                device_id, self.db, self.whisper_url,
+                sample_rate=self.sample_rate,
+                window_seconds=self.classification_window_seconds,
+                hop_seconds=self.classification_hop_seconds
+            )
+            self.sessions[device_id] = session
+        session.touch()
+        return session
+
+    def evict_idle_sessions(self):
+        """Drop idle sessions and close their archive files; returns them so their whisper sockets can be closed."""
+        evicted = []
+        for device_id, session in list(self.sessions.items()):
+            if session.idle_seconds() > self.session_idle_timeout and not session.pending_classifications:
+                logger.info(f"Evicting audio session for device {device_id} after {session.idle_seconds():.0f}s idle")
+                del self.sessions[device_id]
+                self.archive.close_device(device_id)
+                evicted.append(session)
+        return evicted
+
+    def start(self):
+        """Start periodic session eviction and known class reloads on the running event loop."""
+        if self.eviction_task is None:
+            self.eviction_task = asyncio.create_task(self.run_session_eviction())
+        if self.known_classes_task is None and self.known_classes_refresh_seconds > 0:
+            self.known_classes_task = asyncio.create_task(self.run_known_classes_refresh())
+
+    async def run_known_classes_refresh(self):
         while True:
+            await asyncio.sleep(self.known_classes_refresh_seconds)
+            await asyncio.to_thread(self.update_known_classes)
+
+    async def run_session_eviction(self, interval=30):
+        while True:
+            await asyncio.sleep(interval)
             try:
-                message = self.whisper_ws.recv()
-                self.on_message(message)
-            except Exception as e:
-                logger.error(f"Error receiving message: {e}")
-                break
-        
-    def send_audio_to_whisper(self, audio_data):
-        if self.whisper_ws is None:
-            logger.info("+++++++++++++++++++++++ Connecting to whisper-streaming")
-            self.connect_to_whisper()
-        
-        if self.whisper_ws:
-            try:
-                # logger.info(">>>>>>>>>>>>>>>>>>>>>>> Sending audio to whisper-streaming")
-                # Convert audio_data to Int16Array
-                int16_data = np.frombuffer(audio_data, dtype=np.int16)
-                # Resample to 16000 Hz if necessary
-                if self.sample_rate != 16000:
-                    if self.sample_rate < 16000:
-                        int16_data = self.upsample_buffer(int16_data, self.sample_rate, 16000)
-                # Send the audio data as an ArrayBuffer
-                self.whisper_ws.send(int16_data.tobytes())
-               
+                for session in self.evict_idle_sessions():
+                    # Closing the sync whisper socket waits for its close handshake
+                    await asyncio.to_thread(session.close)
+                if time.monotonic() - self.last_clap_stats_log > 300:
+                    self.last_clap_stats_log = time.monotonic()
+                    logger.info(f"CLAP inference stats: {self.clap_worker.stats()}")
             except Exception as e:
-                logger.error(f"==================== Error sending audio to whisper-streaming: {e}")
-                self.whisper_ws = None
-
-    def upsample_buffer(self, buffer, sampleRate, outSampleRate):
-        if outSampleRate == sampleRate:
-            return buffer
-        if outSampleRate < sampleRate:
-            raise ValueError('upsampling rate should be larger than original sample rate')
-        
-        sampleRateRatio = outSampleRate / sampleRate
-        newLength = int(len(buffer) * sampleRateRatio)
-        result = np.zeros(newLength, dtype=np.int16)
-        
-        for i in range(newLength):
-            sourceIndex = int(i / sampleRateRatio)
-            result[i] = buffer[sourceIndex]
-        
-        return result
-    async def detect_known_audio_classes(self, audio_path):
-        if not os.path.exists(audio_path):
-            # logger.warning(f"Audio file not found: {audio_path}")
+                logger.error(f"Error evicting idle audio sessions: {e}")
+
+    def close(self):
+        for task in (self.eviction_task, self.known_classes_task):
+            if task is not None:
+                task.cancel()
+        self.eviction_task = self.known_classes_task = None
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+        self.archive.close()
+        self.clap_worker.close()
+        self.class_trainer.close()
+
+    async def detect_known_audio_classes(self, session, audio_data, sr=8000):
+        # audio_data is a float32 window straight from the session's ring buffer
+        future = self.clap_worker.submit(audio_data, sr)
+        if future is None:
+            logger.error(f"CLAP inference queue full, dropped window for device {session.device_id}")
+            return
+        audio_embed = await asyncio.wrap_future(future)
+
+        # One matmul + sigmoid scores every class; take a reference so a retrain can swap it mid-window
+        scorer = self.class_scorer
+        if not len(scorer):
             return
+        scores = scorer.score(audio_embed)[0]
+        known_classes = {known_class['id']: known_class for known_class in self.known_classes}
 
-        # Load audio data with the required sample rate of 48000
-        audio_data, sr = librosa.load(audio_path, sr=8000)
-        # logger.info(f"Loaded audio data shape: {audio_data.shape}, sr: {sr}")
-
-        # Ensure the audio data is at 48000 Hz sample rate
-        if sr != 48000:
-            audio_data = librosa.resample(audio_data, orig_sr=sr, target_sr=48000)
-            sr = 48000
-        # logger.info(f"Audio data shape: {audio_data.shape}, Sample rate: {sr}")
-
-        audio_embed = self.embed_audio(audio_data, sr)
-
-        for known_class in self.known_classes:
-            class_id = known_class['id']
-            classifier = self.svm_classifiers.get(class_id)
-
-            if classifier:
-                similarity = classifier.predict_proba(audio_embed)[0][1]
-
-                time_since_last_sent = None
-                try:
-                    # Query the gotify_message_log to find the last "sent_at" timestamp
-                    last_sent_at_row = self.db.sync_query(
-                        """
-                        SELECT sent_at AT TIME ZONE 'UTC' FROM gotify_message_log 
-                        ORDER BY sent_at DESC 
-                        LIMIT 1
-                        """
-                    )
-                    if last_sent_at_row:
-                        last_sent_at = last_sent_at_row[0][0]
-                        time_since_last_sent = datetime.datetime.utcnow() - last_sent_at
- 
-                except Exception as e:
-                    logger.error(f"Error querying gotify_message_log: {str(e)}")
-
-                get_irregular_low_similarity_detections = (time_since_last_sent is not None and time_since_last_sent.total_seconds() > 900 and similarity > 0.1 and similarity < known_class['radius_threshold'])
+        # Seconds since any notification was sent, from memory instead of gotify_message_log
+        seconds_since_last_sent = self.rate_state.seconds_since_last_sent()
+
+        clip_ref = None
+        for class_id, similarity in zip(scorer.class_ids, scores):
+            known_class = known_classes.get(class_id)
+            if known_class:
+                get_irregular_low_similarity_detections = (seconds_since_last_sent is not None and seconds_since_last_sent > 900 and similarity > 0.1 and similarity < known_class['radius_threshold'])
                 if get_irregular_low_similarity_detections:
                     logger.info(f"Detected known audio class: {known_class['name']} with similarity {similarity:.4f} since it has been more than 15 minutes and similarity is > 0.1")
 
                 if similarity >= known_class['radius_threshold'] or get_irregular_low_similarity_detections:
                     logger.info(f"Detected known audio class: {known_class['name']} with similarity {similarity:.4f}")
                     try:
-                        # Convert audio data to WAV format
-                        with io.BytesIO() as wav_buffer:
-                            scipy.io.wavfile.write(wav_buffer, sr, audio_data)
-                            wav_data = wav_buffer.getvalue()
-
-                        returned_row = self.db.sync_query(
-                            """
-                            INSERT INTO known_class_detections 
-                            (known_class_id, distance, source_data, source_data_type, metadata, embedding) 
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            RETURNING id
-                            """,
-                            (known_class['id'],
+                        # The clip goes to the blob store once per window, however many classes match
+                        if clip_ref is None:
+                            clip_ref = await asyncio.to_thread(self.store_detection_clip, audio_data, sr)
+
+                        inserted_id = await self.async_db.insert_known_class_detection(
+                            known_class['id'],
                             float(similarity),  # Ensure similarity is a Python float
-                            psycopg2.Binary(wav_data),  # Store WAV data as binary
+                            None,  # Audio lives in the blob store, see source_data_ref
                             'audio',
                             json.dumps({
-                                'audio_start_time': self.audio_start_time,
+                                'audio_start_time': session.audio_start_time,
+                                'device_id': session.device_id,
                                 'sample_rate': sr,  # Include sample rate in metadata
+                                'codec': self.detection_clip_codec,
                             }),
-                            json.dumps(audio_embed.squeeze().tolist())  # Convert numpy array to JSON string
-                            )
+                            audio_embed.squeeze(),  # Sent as a binary pgvector value
+                            clip_ref
                         )
-                        inserted_id = returned_row[0][0]
 
                         self.send_gotify_notification(known_class, similarity, inserted_id)
 
                     except Exception as e:
                         logger.error(f"Error inserting known class detection: {str(e)}")
 
-            # Delete the audio classification buffer file
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
+    def store_detection_clip(self, audio_data, sample_rate):
+        # Native-rate 16-bit FLAC (or Ogg Opus) instead of a 48 kHz float WAV in the row
+        with io.BytesIO() as clip_buffer:
+            if self.detection_clip_codec == "opus":
+                soundfile.write(clip_buffer, audio_data, sample_rate, format="OGG", subtype="OPUS")
+            else:
+                soundfile.write(clip_buffer, audio_data, sample_rate, format="FLAC", subtype="PCM_16")
+            clip = clip_buffer.getvalue()
+        return self.detection_blobs.put(clip, self.detection_clip_codec)
+
+    async def classify_window(self, session, window):
+        session.pending_classifications += 1
+        try:
+            await self.detect_known_audio_classes(session, window, self.sample_rate)
+        except Exception as e:
+            logger.error(f"Error classifying audio window for device {session.device_id}: {e}")
+        finally:
+            session.pending_classifications -= 1
 
     def send_gotify_notification(self, known_class, similarity, inserted_id):
         try:
@@ -268,7 +341,7 @@ class AudioProcessor:
                 },
                 "client::notification": {
                     "click": {
-                        "url": f"http://{os.getenv('SERVER_URL')}:{os.getenv('SERVER_PORT')}/verify-detection/{inserted_id}?name={known_class['name']}&audio_url=http://{os.getenv('SERVER_URL')}:{os.getenv('SERVER_PORT')}/get-detection-audio/{inserted_id}"
+                        "url": f"http://{os.getenv('SERVER_URL')}:{os.getenv('SERVER_PORT')}/verify-detection/{inserted_id}?name={known_class['name']}&audio_url=http://{os.getenv('SERVER_URL')}:{os.getenv('SERVER_PORT')}/detection-audio/{inserted_id}"
                     }
                 },
                 # "android::action": {
@@ -286,107 +359,56 @@ class AudioProcessor:
                     title=f"Detected {known_class['name']}", 
                     message=f"Similarity: {similarity:.4f}, Threshold: {known_class['radius_threshold']:.4f}",
                     extras=extras,
-                    priority=known_class.get('gotify_priority', 10)
+                    priority=known_class.get('gotify_priority', 10),
+                    known_class=known_class['name']
                 )
         except Exception as e:
             logger.error(f"Error sending gotify message: {str(e)}")
 
     async def handle_audio_message(self, message, websocket, device_id):
-        audio_data_base64 = message.get("data")
-        if not audio_data_base64:
+        # base64 text for JSON messages, a memoryview over the frame for binary ones
+        audio_payload = message.get("data")
+        if not audio_payload:
             logger.error("No audio data received")
             raise HTTPException(status_code=422, detail="Unprocessable Entity: No audio data received")
-        self.audio_start_time = datetime.datetime.now().isoformat()
-        audio_data = self.decode_and_decompress_audio(audio_data_base64)
+        session = self.get_session(device_id)
+        if message.get("timestamp"):
+            session.audio_start_time = datetime.datetime.fromtimestamp(message["timestamp"] / 1000).isoformat()
+        else:
+            session.audio_start_time = datetime.datetime.now().isoformat()
+        audio_data = self.decode_and_decompress_audio(audio_payload)
         
         # Long term storage of audio
-        self.today_wav_file_path = self.calculate_date_path(source=device_id)
-        self.append_audio_to_file(audio_data, file_path=self.today_wav_file_path)
-        file_length = os.path.getsize(self.today_wav_file_path) - 44
-        self.write_wav_header(self.today_wav_file_path, self.sample_rate, self.sample_width * 8, 1, file_length)
+        session.today_wav_file_path = self.archive.write(device_id, audio_data)
 
 
+        # Decode once; the 16 kHz ASR stream and the 48 kHz CLAP windows both start from here
+        samples = pcm16_to_float32(audio_data)
+
         try:
-            self.send_audio_to_whisper(audio_data)
+            session.send_audio_to_whisper(samples)
         except Exception as e:
             logger.error(f"Error sending audio to Whisper: {str(e)}")
 
 
-        # Create the audio classification buffer file if it doesn't exist
-        if not os.path.exists(self.audio_classification_buffer_path):
-            with open(self.audio_classification_buffer_path, 'wb') as f:
-                # Write an empty WAV header
-                f.write(b'\x00' * 44)
-            # logger.info(f"Created new audio classification buffer file: {self.audio_classification_buffer_path}")
-        self.append_audio_to_file(audio_data, file_path=self.audio_classification_buffer_path)
-        file_length = os.path.getsize(self.audio_classification_buffer_path) - 44
-        self.write_wav_header(self.audio_classification_buffer_path, self.sample_rate, self.sample_width * 8, 1, file_length)
-        samples_per_5_seconds = 5 * self.sample_rate
-
-        if file_length >= samples_per_5_seconds * self.sample_width:
-            if self.classification_lock.locked():
-                pass
-            else:
-                self.send_audio_to_whisper(audio_data)
-                # Convert the audio data to float32 numpy array
-                async with self.classification_lock:
-                    asyncio.create_task(self.detect_known_audio_classes(self.audio_classification_buffer_path))
-                
-
-        # Pass the audio data to the whisper streaming processor
-        # self.online.process_audio(audio_data)
-        # ad = np.frombuffer(audio_data, dtype=np.float32)
-        
+        # Sliding classification windows are kept in memory per device
+        session.classification_buffer.write(samples)
+        # The CLAP worker queues and batches them, so a slow window no longer drops the next one
+        for window in session.classification_buffer.ready_windows():
+            # The loop only keeps weak references to tasks; hold them until they finish
+            task = asyncio.create_task(self.classify_window(session, window))
+            self.classification_tasks.add(task)
+            task.add_done_callback(self.classification_tasks.discard)
+
         
     
-    def embed_audio(self, audio_data, sample_rate):
-        inputs = self.clap_processor(audios=audio_data, return_tensors="pt", sampling_rate=sample_rate)
-        audio_embed = self.clap_model.get_audio_features(**inputs)
-        # logging.info("audio_embed before numpy detach", audio_embed)
-        return audio_embed.detach().numpy()
-
-    def calculate_date_path(self, days_in_past=0, format="wav", prefix="", source="phone"):
-        target_day = (datetime.datetime.now() - datetime.timedelta(days=days_in_past)).strftime("%Y-%m-%d")
-        return f"audio/persistent/{prefix}{source}_{target_day}.{format}"
-    
-    def create_wav_header(self, sample_rate, bits_per_sample, channels, data_size):
-        chunk_id = b'RIFF'
-        chunk_size = (36 + data_size).to_bytes(4, 'little')
-        format = b'WAVE'
-        subchunk1_id = b'fmt '
-        subchunk1_size = (16).to_bytes(4, 'little')
-        audio_format = (1).to_bytes(2, 'little')  # PCM
-        num_channels = channels.to_bytes(2, 'little')
-        sample_rate_bytes = sample_rate.to_bytes(4, 'little')
-        byte_rate = ((sample_rate * channels * bits_per_sample) // 8).to_bytes(4, 'little')
-        block_align = ((channels * bits_per_sample) // 8).to_bytes(2, 'little')
-        bits_per_sample_bytes = bits_per_sample.to_bytes(2, 'little')
-        subchunk2_id = b'data'
-        subchunk2_size = data_size.to_bytes(4, 'little')
-        header = (chunk_id + chunk_size + format + subchunk1_id + subchunk1_size + audio_format +
-                  num_channels + sample_rate_bytes + byte_rate + block_align + bits_per_sample_bytes +
-                  subchunk2_id + subchunk2_size)
-        return header
-
-    def write_wav_header(self, file_path, sample_rate, bits_per_sample, channels, data_size):
-        header = self.create_wav_header(sample_rate, bits_per_sample, channels, data_size)
-        with open(file_path, 'r+b') as f:
-            f.seek(0)
-            f.write(header)
-
-    def decode_and_decompress_audio(self, audio_data_base64):
-        compressed_audio_data = base64.b64decode(audio_data_base64)
-        decompressed_audio_data = zstd.decompress(compressed_audio_data)
-        return decompressed_audio_data
-
-    def append_audio_to_file(self, audio_data, file_path):
-        if not os.path.exists(file_path):
-            # Create a new WAV file with header if it doesn't exist
-            with wave.open(file_path, 'wb') as wf:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(self.sample_width)
-                wf.setframerate(self.sample_rate)
-                wf.writeframes(b'')  # Write empty frames to create the header
-
-        with open(file_path, "ab") as audio_file:
-            audio_file.write(audio_data)
+    def decode_and_decompress_audio(self, audio_payload):
+        if isinstance(audio_payload, str):
+            compressed_audio_data = base64.b64decode(audio_payload)
+        else:
+            compressed_audio_data = audio_payload
+        try:
+            return self.decompressor.decompress(compressed_audio_data)
+        except zstandard.ZstdError:
+            # Frames written without a content size have to be streamed
+            return self.decompressor.decompressobj().decompress(compressed_audio_data)
@@ -44,14 +44,18 @@ class ImageProcessor:
         # Query the database to check if the image hash already exists
         if image_hash:
             query = "SELECT id FROM image_data WHERE image_id = %s"
-            result = self.db.execute(query, (image_id,))
+            result = await self.db.execute_async(query, (image_id,))
             
             if result:
                 print(f"Image with hash {image_hash} already exists in the database. Skipping insertion.")
                 return  # Exit the function if the image already exists
         
         # If the image doesn't exist or no hash was provided, proceed with processing
-        compressed_image_data = base64.b64decode(image_data_base64)
+        # Binary frames hand over the compressed bytes directly; JSON messages carry base64
+        if isinstance(image_data_base64, str):
+            compressed_image_data = base64.b64decode(image_data_base64)
+        else:
+            compressed_image_data = bytes(image_data_base64)
         image_data = zstd.decompress(compressed_image_data)
 
         try:
@@ -78,7 +82,7 @@ class ImageProcessor:
         )
         RETURNING id
         """
-        result = self.db.execute_query(query, (
+        result = await self.db.execute_async(query, (
             device_id, image_data, is_screenshot, is_generated, is_manual, 
             is_front_camera, is_rear_camera, image_embedding, image_hash
         ))
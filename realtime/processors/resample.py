@@ -0,0 +1,96 @@
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin, lfilter, lfilter_zi, resample_poly
+
+
+def _ratio(in_rate, out_rate):
+    divisor = gcd(int(in_rate), int(out_rate))
+    return int(out_rate) // divisor, int(in_rate) // divisor
+
+
+@lru_cache(maxsize=None)
+def design_filter(up, down):
+    """Anti-aliasing low-pass taps for an up/down ratio; same design resample_poly uses by default."""
+    max_rate = max(up, down)
+    taps = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(np.float32)
+    taps.setflags(write=False)
+    return taps
+
+
+@lru_cache(maxsize=None)
+def polyphase_bank(up):
+    """
+    design_filter(up, 1) split into its up phases, as a (taps_per_phase, up) matrix with the
+    taps reversed, so integer upsampling is one matmul over sliding windows of the input.
+    """
+    taps = design_filter(up, 1) * up
+    taps_per_phase = -(-len(taps) // up)
+    padded = np.zeros(taps_per_phase * up, dtype=np.float32)
+    padded[:len(taps)] = taps
+    bank = np.ascontiguousarray(padded.reshape(taps_per_phase, up)[::-1])
+    bank.setflags(write=False)
+    return bank
+
+
+def _upsample(samples, up):
+    # Same output as resample_poly(samples, up, 1, window=design_filter(up, 1)), without
+    # filtering the zero-stuffed signal at the output rate
+    if len(samples) == 0:
+        return np.zeros(0, dtype=np.float32)
+    bank = polyphase_bank(up)
+    taps_per_phase = len(bank)
+    # The filter is centered, so each output looks half its span ahead
+    delay = (len(design_filter(up, 1)) - 1) // 2 // up
+    padded = np.concatenate((
+        np.zeros(taps_per_phase - 1 - delay, dtype=np.float32),
+        np.asarray(samples, dtype=np.float32),
+        np.zeros(delay, dtype=np.float32),
+    ))
+    return (sliding_window_view(padded, taps_per_phase) @ bank).reshape(-1)
+
+
+def pcm16_to_float32(pcm_bytes):
+    return np.frombuffer(pcm_bytes, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def float32_to_pcm16(samples):
+    return (np.clip(samples, -1.0, 32767 / 32768) * 32768.0).astype("<i2")
+
+
+def resample(samples, in_rate, out_rate):
+    """Polyphase resampling of a whole block (e.g. a classification window) with cached taps."""
+    if in_rate == out_rate:
+        return samples
+    up, down = _ratio(in_rate, out_rate)
+    if down == 1:
+        # 8 kHz -> 48 kHz for CLAP
+        return _upsample(samples, up)
+    return resample_poly(samples, up, down, window=design_filter(up, down)).astype(np.float32, copy=False)
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler for a chunked stream.
+
+    Filter state and decimation phase carry over between chunks, so consecutive chunks give
+    the same output as resampling the whole stream at once (delayed by the filter's group
+    delay) instead of clicking at every chunk boundary.
+    """
+
+    def __init__(self, in_rate, out_rate):
+        self.up, self.down = _ratio(in_rate, out_rate)
+        self.taps = design_filter(self.up, self.down) * self.up
+        self.state = lfilter_zi(self.taps, 1.0) * 0.0
+        self.phase = 0
+
+    def process(self, samples):
+        if self.up == 1 and self.down == 1:
+            return samples
+        stuffed = np.zeros(len(samples) * self.up, dtype=np.float32)
+        stuffed[::self.up] = samples
+        filtered, self.state = lfilter(self.taps, 1.0, stuffed, zi=self.state)
+        out = filtered[self.phase::self.down]
+        self.phase = (self.phase - len(stuffed)) % self.down
+        return out.astype(np.float32, copy=False)
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Preallocated float32 ring buffer that emits fixed-size sliding windows.
+
+    Every sample is stored twice (at i and i + capacity), so any window up to capacity
+    samples long is one contiguous slice and never needs to be stitched together.
+    Windows are window_size samples long and start hop_size samples apart (hop_size <
+    window_size gives overlapping windows).
+    """
+
+    def __init__(self, window_size, hop_size=None, capacity=None):
+        self.window_size = int(window_size)
+        self.hop_size = int(hop_size or window_size)
+        self.capacity = int(capacity or 2 * self.window_size)
+        if self.capacity < self.window_size:
+            raise ValueError("capacity must be at least window_size")
+        self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._total_written = 0
+        self._next_window_end = self.window_size
+        self.windows_skipped = 0
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) > self.capacity:
+            self._total_written += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        start = self._total_written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        for offset in (0, self.capacity):
+            self._data[offset + start:offset + start + first] = samples[:first]
+            # Wrapped part goes to the beginning of each copy
+            self._data[offset:offset + len(samples) - first] = samples[first:]
+        self._total_written += len(samples)
+
+    def ready_windows(self):
+        """Yield a copy of every complete window written since the last call."""
+        # Windows that were already overwritten can't be produced any more
+        oldest_available_end = self._total_written - self.capacity + self.window_size
+        if self._next_window_end < oldest_available_end:
+            skipped = (oldest_available_end - self._next_window_end + self.hop_size - 1) // self.hop_size
+            self.windows_skipped += skipped
+            self._next_window_end += skipped * self.hop_size
+
+        while self._next_window_end <= self._total_written:
+            start = (self._next_window_end - self.window_size) % self.capacity
+            yield self._data[start:start + self.window_size].copy()
+            self._next_window_end += self.hop_size
+
+    def __len__(self):
+        return min(self._total_written, self.capacity)
@@ -0,0 +1,62 @@
+import json
+import struct
+import uuid
+
+# Binary websocket frames: a fixed little-endian header followed by the raw zstd payload.
+#   version   uint8
+#   type      uint8   (FRAME_TYPES)
+#   device_id uint32
+#   message_id 16 bytes (UUID, big-endian as in uuid.UUID.bytes)
+#   timestamp int64   (milliseconds since epoch, client clock)
+# Image frames prefix the payload with a uint16 length and that many bytes of JSON metadata
+# (is_screenshot, image_hash, ...), the same fields the JSON image message carries.
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BBI16sq")
+IMAGE_METADATA_LENGTH = struct.Struct("<H")
+
+FRAME_TYPES = {
+    1: "audio",
+    2: "image",
+}
+
+
+def decode_frame(data):
+    """
+    Turn a binary websocket frame into the same message dict the JSON protocol produces.
+
+    "data" is a memoryview over the received bytes, so the payload is not copied.
+    """
+    view = memoryview(data)
+    if len(view) < FRAME_HEADER.size:
+        raise ValueError(f"Binary frame too short: {len(view)} bytes")
+    version, type_code, device_id, message_id, timestamp = FRAME_HEADER.unpack_from(view)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported binary frame version {version}")
+    if type_code not in FRAME_TYPES:
+        raise ValueError(f"Unknown binary frame type {type_code}")
+
+    message = {
+        "type": FRAME_TYPES[type_code],
+        "device_id": device_id,
+        "message_id": str(uuid.UUID(bytes=bytes(message_id))),
+        "timestamp": timestamp,
+    }
+    payload = view[FRAME_HEADER.size:]
+    if message["type"] == "image":
+        (metadata_length,) = IMAGE_METADATA_LENGTH.unpack_from(payload)
+        metadata_end = IMAGE_METADATA_LENGTH.size + metadata_length
+        metadata = json.loads(bytes(payload[IMAGE_METADATA_LENGTH.size:metadata_end])) if metadata_length else {}
+        message["data"] = {**metadata, "data": payload[metadata_end:]}
+    else:
+        message["data"] = payload
+    return message
+
+
+def encode_frame(message_type, device_id, message_id, timestamp, payload, metadata=None):
+    """Build a binary frame; used by non-Android clients and for testing the server."""
+    type_code = next(code for code, name in FRAME_TYPES.items() if name == message_type)
+    header = FRAME_HEADER.pack(FRAME_VERSION, type_code, device_id, uuid.UUID(str(message_id)).bytes, timestamp)
+    if message_type == "image":
+        metadata_bytes = json.dumps(metadata or {}).encode("utf-8")
+        header += IMAGE_METADATA_LENGTH.pack(len(metadata_bytes)) + metadata_bytes
+    return header + bytes(payload)
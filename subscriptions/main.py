@@ -7,7 +7,6 @@ import logging
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import re
-from collections import defaultdict
 from handlers.sensor.main import handle_phone_stationary, handle_phone_screen_up
 from handlers.gps.main import handle_gps_data
 from handlers.email.main import handle_email_check
@@ -16,15 +15,12 @@ from handlers.archiver import handle_device_log
 from handlers.alerts import handle_get_back_to_work
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from libraries.gotify.gotify import send_gotify_message
+from libraries.gotify.gotify import send_gotify_message, get_rate_state
 
 # Set up logging
 logging.basicConfig(filename='subscription_handler.log', level=logging.INFO, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Global dictionary to track notifications
-notification_tracker = defaultdict(list)
-
 class DBSubscription:
     def __init__(self, label, query, interval, handler, max_notifications_per_minute, trigger_on_all_queries=False):
         self.db = DB(
@@ -59,12 +55,9 @@ class DBSubscription:
         self.db.poll_query(self.query, self.interval, self.handle_polling, self.trigger_on_all_queries)
 
     def send_notification(self, title, message, priority):
-        current_time = datetime.now()
-        notification_tracker[title] = [timestamp for timestamp in notification_tracker[title] if timestamp > current_time - timedelta(minutes=1)]
-        
-        if len(notification_tracker[title]) < self.max_notifications_per_minute:
+        # Sends are recorded by send_gotify_message, so every service throttles on the same view
+        if get_rate_state().count_since(60, title=title) < self.max_notifications_per_minute:
             send_gotify_message(title, message, priority)
-            notification_tracker[title].append(current_time)
         else:
             if self.max_notifications_per_minute >0:
                 logging.warning(f"Notification limit reached for {title}. Skipping notification.")
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark for decoding one websocket/TCP audio message of raw PCM_16.
+
+Compares the previous soundfile.SoundFile + librosa.load path against pcm.PCM16Decoder,
+with and without resampling 8 kHz to 16 kHz.
+
+Run from the whisper_streaming directory:
+    python -m benchmarks.pcm_decode_benchmark
+"""
+import io
+import timeit
+import numpy as np
+from pcm import PCM16Decoder
+
+SAMPLE_RATE = 16000
+CHUNK_SAMPLES = 3200   # 200 ms at 16 kHz, what the realtime service sends per message
+REPEAT = 5
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    rng = np.random.default_rng(0)
+    message = (rng.standard_normal(CHUNK_SAMPLES) * 3000).astype("<i2").tobytes()
+
+    decoder = PCM16Decoder()
+    after = best_of(lambda: decoder.decode(message), 2000)
+    try:
+        import librosa
+        import soundfile
+
+        def soundfile_librosa():
+            sf = soundfile.SoundFile(io.BytesIO(message), channels=1, endian="LITTLE", samplerate=SAMPLE_RATE, subtype="PCM_16", format="RAW")
+            audio, _ = librosa.load(sf, sr=SAMPLE_RATE, dtype=np.float32)
+            return audio
+
+        assert np.allclose(soundfile_librosa(), decoder.decode(message))
+        before = best_of(soundfile_librosa, 200)
+        print(f"{'decode 200 ms message':<28} before {before * 1e6:10.1f} us   after {after * 1e6:10.1f} us   speedup {before / after:6.1f}x")
+    except ImportError:
+        print(f"{'decode 200 ms message':<28} soundfile/librosa not installed   after {after * 1e6:10.1f} us")
+
+    resampling = PCM16Decoder(8000, 16000)
+    narrowband = message[:CHUNK_SAMPLES]   # 200 ms at 8 kHz
+    print(f"{'decode + 8k -> 16k':<28} after {best_of(lambda: resampling.decode(narrowband), 500) * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
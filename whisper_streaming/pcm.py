@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Raw PCM_16 decoding for the streaming servers, without soundfile/librosa per message.
+
+The resampler follows realtime/processors/resample.py (that code isn't in this container's build
+context): polyphase filter taps are designed once per rate pair, and filter state carries over
+between chunks.
+"""
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from scipy.signal import firwin, lfilter, lfilter_zi
+
+
+def pcm16_to_float32(pcm_bytes):
+    return np.frombuffer(pcm_bytes, dtype="<i2").astype(np.float32) / 32768.0
+
+
+@lru_cache(maxsize=None)
+def design_filter(up, down):
+    # same anti-aliasing design scipy.signal.resample_poly uses by default
+    max_rate = max(up, down)
+    taps = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(np.float32)
+    taps.setflags(write=False)
+    return taps
+
+
+class StreamingResampler:
+    """Polyphase resampling of a chunked stream, without clicks at chunk boundaries."""
+
+    def __init__(self, in_rate, out_rate):
+        divisor = gcd(int(in_rate), int(out_rate))
+        self.up, self.down = int(out_rate) // divisor, int(in_rate) // divisor
+        self.taps = design_filter(self.up, self.down) * self.up
+        self.state = lfilter_zi(self.taps, 1.0) * 0.0
+        self.phase = 0
+
+    def process(self, samples):
+        if self.up == 1 and self.down == 1:
+            return samples
+        stuffed = np.zeros(len(samples) * self.up, dtype=np.float32)
+        stuffed[::self.up] = samples
+        filtered, self.state = lfilter(self.taps, 1.0, stuffed, zi=self.state)
+        out = filtered[self.phase::self.down]
+        self.phase = (self.phase - len(stuffed)) % self.down
+        return out.astype(np.float32, copy=False)
+
+
+class PCM16Decoder:
+    """Decodes one client's little-endian PCM_16 byte stream to float32.
+
+    A byte left over from an odd-length read (TCP doesn't keep sample boundaries) is kept for
+    the next call. With in_rate != out_rate the samples are resampled on the way.
+    """
+
+    def __init__(self, in_rate=None, out_rate=None):
+        self.resampler = StreamingResampler(in_rate, out_rate) if in_rate and out_rate and in_rate != out_rate else None
+        self.pending = b""
+
+    def decode(self, raw_bytes):
+        if self.pending:
+            raw_bytes = self.pending + raw_bytes
+        usable = len(raw_bytes) - len(raw_bytes) % 2
+        self.pending = raw_bytes[usable:]
+        audio = pcm16_to_float32(memoryview(raw_bytes)[:usable])
+        if self.resampler is not None:
+            audio = self.resampler.process(audio)
+        return audio
@@ -0,0 +1,149 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    def __init__(self, fn, future, audio=None):
+        self.fn = fn
+        self.future = future
+        self.audio = audio
+
+
+class DecodeScheduler:
+    """
+    The one thread that runs the shared ASR model, so the asyncio server loop never blocks
+    on a transcribe.
+
+    Sessions queue jobs that touch their OnlineASRProcessor (process(), call()); each session's
+    jobs run in order, and sessions take turns, one job each, in round-robin order. Audio that
+    arrives while a session's decode is still queued is appended to that queued decode
+    instead of making another one, so a session that falls behind catches up with fewer,
+    longer transcribes. Results come back as asyncio futures on the server loop.
+
+    faster-whisper 1.0.x has no batched transcribe, so jobs run one at a time; the gain is
+    that N streams share the GPU without stalling the loop or each other.
+    """
+
+    def __init__(self, loop, stats_interval=60):
+        self.loop = loop
+        self.stats_interval = stats_interval
+        self._ready = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.jobs_run = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="asr-decode", daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, session, job):
+        session.jobs.append(job)
+        if not session.queued and not session.decoding:
+            session.queued = True
+            self._ready.append(session)
+            self._cond.notify()
+
+    def process(self, session, audio):
+        """
+        Insert audio into the session's processor and run process_iter() on the decode thread.
+        Returns a future for the process_iter() result, or None when the audio was merged into
+        a decode that is already queued (its future will carry the result).
+        """
+        with self._cond:
+            if session.jobs and session.jobs[-1].audio is not None:
+                session.jobs[-1].audio.append(audio)
+                return None
+            job = _Job(self._process, self.loop.create_future(), [audio])
+            self._enqueue(session, job)
+            return job.future
+
+    def call(self, session, fn):
+        """Run fn(online) on the decode thread, after the session's earlier jobs."""
+        with self._cond:
+            job = _Job(fn, self.loop.create_future())
+            self._enqueue(session, job)
+            return job.future
+
+    def discard(self, session):
+        """Drop a closed session's queued jobs."""
+        with self._cond:
+            jobs, session.jobs = session.jobs, collections.deque()
+            if session.queued:
+                self._ready.remove(session)
+                session.queued = False
+        for job in jobs:
+            self.loop.call_soon_threadsafe(job.future.cancel)
+
+    @staticmethod
+    def _process(online, audio):
+        for chunk in audio:
+            online.insert_audio_chunk(chunk)
+        return online.process_iter()
+
+    def _run(self):
+        last_stats = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                session = self._ready.popleft()
+                session.queued = False
+                session.decoding = True
+                job = session.jobs.popleft()
+
+            started = time.monotonic()
+            try:
+                if job.audio is not None:
+                    result = job.fn(session.online, job.audio)
+                    self.audio_seconds += sum(len(chunk) for chunk in job.audio) / session.online.SAMPLING_RATE
+                else:
+                    result = job.fn(session.online)
+                error = None
+            except Exception as e:
+                logger.error(f"Decode job for session {session.id} failed: {e}")
+                result, error = None, e
+            self.busy_seconds += time.monotonic() - started
+            self.jobs_run += 1
+            self.loop.call_soon_threadsafe(self._resolve, job.future, result, error)
+
+            with self._cond:
+                session.decoding = False
+                # Back of the line, so every waiting session gets a turn first
+                if session.jobs and not session.queued:
+                    session.queued = True
+                    self._ready.append(session)
+
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                logger.info(f"Decode scheduler stats: {self.stats()}")
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "jobs_run": self.jobs_run,
+            "queued_sessions": len(self._ready),
+            "audio_seconds": round(self.audio_seconds, 1),
+            "busy_seconds": round(self.busy_seconds, 1),
+            # Decode time per second of audio across all sessions; below 1 keeps up with real time
+            "real_time_factor": round(self.busy_seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+        }
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
@@ -0,0 +1,74 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ASRSession:
+    """One websocket client: its own OnlineASRProcessor (audio buffer and HypothesisBuffer) over the shared ASR model."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket, online):
+        self.id = next(self._ids)
+        self.websocket = websocket
+        self.online = online
+        self.started = time.monotonic()
+        self.last_active = self.started
+        # Decode jobs waiting for the DecodeScheduler, and where the session is in its rotation
+        self.jobs = collections.deque()
+        self.queued = False
+        self.decoding = False
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_active
+
+
+class SessionManager:
+    """
+    Hands each connection its own OnlineASRProcessor from online_factory, so concurrent clients
+    never share audio or hypotheses, while every processor uses the one loaded ASRBase model.
+
+    At most max_sessions are open at once; open() returns None beyond that. Sessions that
+    haven't sent audio for idle_timeout seconds are closed by run_eviction().
+    """
+
+    def __init__(self, online_factory, max_sessions=4, idle_timeout=300):
+        self.online_factory = online_factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+
+    def open(self, websocket):
+        if len(self.sessions) >= self.max_sessions:
+            logger.warning(f"Refusing connection: {len(self.sessions)}/{self.max_sessions} sessions open")
+            return None
+        session = ASRSession(websocket, self.online_factory())
+        self.sessions[session.id] = session
+        logger.info(f"Session {session.id} opened ({len(self.sessions)}/{self.max_sessions})")
+        return session
+
+    def close(self, session):
+        if self.sessions.pop(session.id, None) is not None:
+            logger.info(f"Session {session.id} closed after {time.monotonic() - session.started:.0f}s ({len(self.sessions)}/{self.max_sessions})")
+
+    async def evict_idle(self):
+        for session in list(self.sessions.values()):
+            if session.idle_seconds() >= self.idle_timeout:
+                logger.info(f"Evicting session {session.id}, idle for {session.idle_seconds():.0f}s")
+                self.close(session)
+                try:
+                    await session.websocket.close(code=1001, reason="idle")
+                except Exception as e:
+                    logger.error(f"Error closing idle session {session.id}: {e}")
+
+    async def run_eviction(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1))
+            await self.evict_idle()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Streaming voice activity detection in front of OnlineASRProcessor.
+
+Audio is cut into fixed frames and each frame is labelled speech or non-speech, either by its
+RMS energy or by the Silero VAD model that ships with faster-whisper. Only speech (plus a little
+padding around it) is passed on, so Whisper never transcribes the quiet hours of an always-on mic.
+"""
+import collections
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EnergyClassifier:
+    """speech = frame RMS at or above threshold"""
+
+    def __init__(self, threshold=0.01, frame_samples=480):
+        self.threshold = threshold
+        self.frame_samples = frame_samples
+
+    def __call__(self, frames):
+        return np.sqrt(np.mean(frames * frames, axis=1)) >= self.threshold
+
+
+class SileroClassifier:
+    """speech = Silero speech probability at or above threshold. Keeps the model's recurrent state per stream."""
+
+    def __init__(self, threshold=0.5, sample_rate=16000):
+        from faster_whisper.vad import get_vad_model
+        self.model = get_vad_model()   # cached, so every stream shares one ONNX session
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        # the model's supported window: 512 samples at 16 kHz, 256 at 8 kHz
+        self.frame_samples = 512 if sample_rate == 16000 else 256
+        self.state = self.model.get_initial_state(batch_size=1)
+
+    def __call__(self, frames):
+        speech = np.empty(len(frames), dtype=bool)
+        for i, frame in enumerate(frames):
+            probability, self.state = self.model(frame, self.state, self.sample_rate)
+            speech[i] = probability.item() >= self.threshold
+        return speech
+
+
+class StreamingVAD:
+    """Frame-level speech gate with running counters.
+
+    process(audio) returns (speech, silence_started): the samples to forward, and True once when
+    non-speech has lasted silence_samples. padding_frames of non-speech before speech starts and
+    after it ends are forwarded too, so word onsets and endings aren't clipped. Samples that
+    don't fill a frame yet wait for the next call.
+    """
+
+    def __init__(self, classifier, silence_samples, padding_frames=10):
+        self.classifier = classifier
+        self.frame_samples = classifier.frame_samples
+        self.silence_samples = silence_samples
+        self.padding_frames = padding_frames
+        self.pending = np.empty(0, dtype=np.float32)
+        self.pre_roll = collections.deque(maxlen=padding_frames)
+        self.hangover = 0
+        self.silent_samples = 0
+        # nothing to end before the first speech
+        self.in_silence = True
+        self.total_samples = 0
+        self.speech_samples = 0
+
+    def process(self, audio):
+        if len(self.pending):
+            audio = np.concatenate((self.pending, audio))
+        n = len(audio) // self.frame_samples
+        self.pending = audio[n*self.frame_samples:]
+        if n == 0:
+            return audio[:0], False
+        frames = audio[:n*self.frame_samples].reshape(n, self.frame_samples)
+        labels = self.classifier(frames)
+
+        forward = []
+        silence_started = False
+        for frame, is_speech in zip(frames, labels):
+            if is_speech:
+                forward.extend(self.pre_roll)
+                self.pre_roll.clear()
+                forward.append(frame)
+                self.hangover = self.padding_frames
+                self.silent_samples = 0
+                self.in_silence = False
+            else:
+                self.silent_samples += self.frame_samples
+                if self.hangover > 0:
+                    self.hangover -= 1
+                    forward.append(frame)
+                else:
+                    self.pre_roll.append(frame)
+                if not self.in_silence and self.silent_samples >= self.silence_samples:
+                    self.in_silence = True
+                    silence_started = True
+
+        self.total_samples += n*self.frame_samples
+        self.speech_samples += int(np.count_nonzero(labels))*self.frame_samples
+        speech = np.concatenate(forward) if forward else audio[:0]
+        return speech, silence_started
+
+    def speech_ratio(self):
+        return self.speech_samples / self.total_samples if self.total_samples else 0.0
+
+
+def create_vad(kind, silence_samples, energy_threshold=0.01, speech_threshold=0.5, sample_rate=16000, padding_ms=300):
+    if kind == "silero":
+        classifier = SileroClassifier(speech_threshold, sample_rate)
+    else:
+        classifier = EnergyClassifier(energy_threshold, frame_samples=sample_rate * 30 // 1000)
+    padding_frames = max(int(padding_ms / 1000 * sample_rate / classifier.frame_samples), 0)
+    return StreamingVAD(classifier, silence_samples, padding_frames)
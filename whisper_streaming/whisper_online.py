@@ -311,6 +311,52 @@ class HypothesisBuffer:
     def complete(self):
         return self.buffer
 
+class AudioBuffer:
+    """Growable float32 sample buffer with head/tail offsets.
+
+    append() copies only the new samples and consume() only moves the head, so the per-chunk cost
+    doesn't grow with the buffer length. Space in front of the head is reclaimed by moving the
+    live samples down (or doubling the array) only when the tail reaches the end, which is
+    amortized O(1) per sample. view() is a zero-copy, read-only view of the live samples; it is
+    valid until the next append().
+    """
+
+    def __init__(self, capacity=16000*30):
+        self._data = np.empty(capacity, dtype=np.float32)
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def append(self, audio):
+        n = len(audio)
+        if self._tail + n > len(self._data):
+            live = self._tail - self._head
+            if live + n <= len(self._data) // 2:
+                # at least half the array was consumed since the last move
+                self._data[:live] = self._data[self._head:self._tail]
+            else:
+                data = np.empty(max(2*len(self._data), 2*(live + n)), dtype=np.float32)
+                data[:live] = self._data[self._head:self._tail]
+                self._data = data
+            self._head, self._tail = 0, live
+        self._data[self._tail:self._tail + n] = audio
+        self._tail += n
+
+    def consume(self, n):
+        """drops the oldest n samples"""
+        self._head = min(self._head + max(int(n), 0), self._tail)
+
+    def clear(self):
+        self._head = self._tail = 0
+
+    def view(self):
+        v = self._data[self._head:self._tail]
+        v.flags.writeable = False
+        return v
+
+
 class OnlineASRProcessor:
 
     SAMPLING_RATE = 16000
@@ -326,20 +372,22 @@ class OnlineASRProcessor:
         self.tokenizer = tokenizer
         self.logfile = logfile
 
-        self.init()
-
         self.buffer_trimming_way, self.buffer_trimming_sec = buffer_trimming
+        # sized for the longest buffer before trimming kicks in (30 s at most), plus a few chunks
+        self.audio_buffer = AudioBuffer(int((max(self.buffer_trimming_sec, 30) + 5)*self.SAMPLING_RATE))
+
+        self.init()
 
     def init(self):
         """run this when starting or restarting processing"""
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.audio_buffer.clear()
         self.buffer_time_offset = 0
 
         self.transcript_buffer = HypothesisBuffer(logfile=self.logfile)
         self.commited = []
 
     def insert_audio_chunk(self, audio):
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
 
     def prompt(self):
         """Returns a tuple: (prompt, context), where "prompt" is a 200-character suffix of commited text that is inside of the scrolled away part of audio buffer. 
@@ -370,7 +418,7 @@ class OnlineASRProcessor:
         logger.debug(f"PROMPT: {prompt}")
         logger.debug(f"CONTEXT: {non_prompt}")
         logger.debug(f"transcribing {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f} seconds from {self.buffer_time_offset:2.2f}")
-        res = self.asr.transcribe(self.audio_buffer, init_prompt=prompt)
+        res = self.asr.transcribe(self.audio_buffer.view(), init_prompt=prompt)
 
         # transform to [(beg,end,"word1"), ...]
         tsw = self.asr.ts_words(res)
@@ -457,7 +505,7 @@ class OnlineASRProcessor:
         """
         self.transcript_buffer.pop_commited(time)
         cut_seconds = time - self.buffer_time_offset
-        self.audio_buffer = self.audio_buffer[int(cut_seconds*self.SAMPLING_RATE):]
+        self.audio_buffer.consume(cut_seconds*self.SAMPLING_RATE)
         self.buffer_time_offset = time
 
     def words_to_sentences(self, words):
@@ -13,6 +13,8 @@ parser = argparse.ArgumentParser()
 # server options
 parser.add_argument("--host", type=str, default='localhost')
 parser.add_argument("--port", type=int, default=43007)
+parser.add_argument("--input-sample-rate", type=int, default=None, dest="input_sample_rate",
+        help="Sample rate of the PCM the client sends; resampled to 16 kHz for Whisper when set and different.")
 parser.add_argument("--warmup-file", type=str, dest="warmup_file", 
         help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast. It can be e.g. https://github.com/ggerganov/whisper.cpp/raw/master/samples/jfk.wav .")
 
@@ -78,8 +80,7 @@ class Connection:
         return r
 
 
-import io
-import soundfile
+from pcm import PCM16Decoder
 
 # wraps socket and ASR object, and serves one client connection. 
 # next client should be served by a new instance of this object
@@ -89,6 +90,7 @@ class ServerProcessor:
         self.connection = c
         self.online_asr_proc = online_asr_proc
         self.min_chunk = min_chunk
+        self.decoder = PCM16Decoder(args.input_sample_rate, OnlineASRProcessor.SAMPLING_RATE)
 
         self.last_end = None
 
@@ -97,13 +99,14 @@ class ServerProcessor:
         # blocks operation if less than self.min_chunk seconds is available
         # unblocks if connection is closed or a chunk is available
         out = []
-        while sum(len(x) for x in out) < self.min_chunk*SAMPLING_RATE:
+        received = 0
+        while received < self.min_chunk*SAMPLING_RATE:
             raw_bytes = self.connection.non_blocking_receive_audio()
             if not raw_bytes:
                 break
-            sf = soundfile.SoundFile(io.BytesIO(raw_bytes), channels=1,endian="LITTLE",samplerate=SAMPLING_RATE, subtype="PCM_16",format="RAW")
-            audio, _ = librosa.load(sf,sr=SAMPLING_RATE,dtype=np.float32)
+            audio = self.decoder.decode(raw_bytes)
             out.append(audio)
+            received += len(audio)
         if not out:
             return None
         return np.concatenate(out)
@@ -1,10 +1,13 @@
 import asyncio
 import websockets
 import numpy as np
-import soundfile
 import logging
 import os
 from whisper_online import *
+from sessions import SessionManager
+from scheduler import DecodeScheduler
+from pcm import PCM16Decoder
+from vad import create_vad
 import argparse
 
 
@@ -36,79 +39,102 @@ def format_output_transcript(o):
         return None
 
 
-async def audio_stream(websocket, path):
+def new_online():
+    # Same configuration as the factory's processor; only the ASR model is shared
+    return OnlineASRProcessor(asr, online_template.tokenizer, logfile=online_template.logfile,
+                              buffer_trimming=(online_template.buffer_trimming_way, online_template.buffer_trimming_sec))
 
-    out = []
-    silence_candidate = []
-    silence_started = False
-    last_silence_log_time = 0
-    online.init()
-    logger.info("OnlineASRProcessor init")
 
-    try:
+async def send_transcript(websocket, future):
+    # Done-callback for decode futures: forwards committed text to the client
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logger.error(f"Error transcribing: {future.exception()}")
+        return
+    o = future.result()
+    if format_output_transcript(o) is not None:
+        try:
+            await websocket.send(o[2])
+        except websockets.exceptions.ConnectionClosed:
+            pass
 
-        async for message in websocket:
-            audio_data = message
 
-            #convert audio to NumPy array
-            sf = soundfile.SoundFile(io.BytesIO(audio_data), channels=1,endian="LITTLE",samplerate=SAMPLING_RATE, subtype="PCM_16",format="RAW")
-            audio, _ = librosa.load(sf,sr=SAMPLING_RATE,dtype=np.float32)
+def deliver_to(websocket):
+    return lambda future: asyncio.ensure_future(send_transcript(websocket, future))
+
+
+def finish_and_init(online):
+    o = online.finish()
+    online.init()
+    return o
 
-            out.append(audio)
 
-            o = (None, None, None)
+async def audio_stream(websocket, path):
 
-            rms = np.sqrt(np.mean(audio**2))
-            
-            if rms < SILENCE_THRESHOLD:
+    session = sessions.open(websocket)
+    if session is None:
+        await websocket.close(code=1013, reason="too many sessions")
+        return
 
-                silence_candidate.append(audio)
-                silence_candidate_len = sum(len(x) for x in silence_candidate)
+    decoder = PCM16Decoder(args.input_sample_rate, OnlineASRProcessor.SAMPLING_RATE)
+    # Only speech (and a little padding) reaches the processor; long non-speech ends the utterance
+    vad = create_vad(args.stream_vad, SILENCE_SIZE, energy_threshold=SILENCE_THRESHOLD,
+                     speech_threshold=args.stream_vad_threshold, sample_rate=OnlineASRProcessor.SAMPLING_RATE,
+                     padding_ms=args.stream_vad_padding_ms)
+    out = []
+    out_len = 0
 
-                if silence_candidate_len >= SILENCE_SIZE:
-                    out = []
-                    current_time = time.time()  # Get the current time
-                    if current_time - last_silence_log_time >= 2:  # Check if 2 seconds have passed
-                        logger.info("Silence detected")
-                        last_silence_log_time = current_time  # Update the timestamp
-                    
-                    if not silence_started:
-                        o = online.finish()
-                    online.init()
+    try:
 
-                    silence_started = True
-            else:
-                if silence_started:
-                    last_silence_log_time = 0
-                    silence_started = False
+        async for message in websocket:
+            session.touch()
+            #convert raw PCM_16 to a float32 NumPy array
+            audio = decoder.decode(message)
+            speech, silence_started = vad.process(audio)
 
-                silence_candidate = []
+            if len(speech):
+                out.append(speech)
+                out_len += len(speech)
 
-            out_len = sum(len(x) for x in out)
-            if out_len >= MIN_CHUNK_SIZE:
+            if out_len >= MIN_CHUNK_SIZE or (silence_started and out):
                 out_chunk = np.concatenate(out)
-                online.insert_audio_chunk(out_chunk)
-                o = online.process_iter()
+                # Decoded off the event loop; merged into this session's queued decode if one is waiting
+                future = scheduler.process(session, out_chunk)
+                if future is not None:
+                    future.add_done_callback(deliver_to(websocket))
                 out = []
+                out_len = 0
 
-            result = format_output_transcript(o)
-            if result is not None:
-                await websocket.send(o[2])
+            if silence_started:
+                logger.info("Silence detected")
+                # Processor state only changes on the decode thread, in order with the session's decodes
+                scheduler.call(session, finish_and_init).add_done_callback(deliver_to(websocket))
 
     except websockets.exceptions.ConnectionClosed:
-        online.finish()
         logger.info("Connection closed")
+    finally:
+        logger.info(f"Session {session.id}: {vad.speech_ratio():.0%} of {vad.total_samples/OnlineASRProcessor.SAMPLING_RATE:.0f}s was speech")
+        scheduler.discard(session)
+        sessions.close(session)
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--silence-size', type=float, default=2.0, help='Silence segment size in seconds')
-parser.add_argument('--silence-threshold', type=float, default=0.01, help='Silence threshold')
+parser.add_argument('--silence-threshold', type=float, default=0.01, help='Silence threshold (frame RMS) for the energy VAD')
+parser.add_argument('--stream-vad', type=str, default='energy', choices=['energy', 'silero'], help='Speech detector that gates audio before Whisper: frame RMS energy, or the Silero model bundled with faster-whisper')
+parser.add_argument('--stream-vad-threshold', type=float, default=0.5, help='Speech probability threshold for --stream-vad silero')
+parser.add_argument('--stream-vad-padding-ms', type=float, default=300, help='Non-speech audio kept before and after speech so words are not clipped')
 parser.add_argument('--host', type=str, default='localhost', help='Host')
 parser.add_argument('--port', type=int, default=43007, help='Port')
+parser.add_argument('--max-sessions', type=int, default=4, help='Concurrent client sessions sharing the model; more connections are refused')
+parser.add_argument('--input-sample-rate', type=int, default=None, help='Sample rate of the PCM clients send; resampled to 16 kHz for Whisper when set and different')
+parser.add_argument('--session-idle-timeout', type=float, default=300, help='Close sessions that sent no audio for this many seconds')
 
 add_shared_args(parser)
 args = parser.parse_args()
 
-asr, online = asr_factory(args)
+asr, online_template = asr_factory(args)
+sessions = SessionManager(new_online, max_sessions=args.max_sessions, idle_timeout=args.session_idle_timeout)
 
 SAMPLING_RATE = 8000
 MIN_CHUNK_SIZE = args.min_chunk_size*SAMPLING_RATE
@@ -127,5 +153,8 @@ warm_up()
 logger.info("Server started")
 start_server = websockets.serve(audio_stream, args.host, args.port)
 
+# Owns the model from here on; warm_up() above was the last transcribe on this thread
+scheduler = DecodeScheduler(asyncio.get_event_loop())
 asyncio.get_event_loop().run_until_complete(start_server)
+asyncio.get_event_loop().create_task(sessions.run_eviction())
 asyncio.get_event_loop().run_forever()